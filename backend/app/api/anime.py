@@ -1,17 +1,26 @@
-from fastapi import APIRouter, HTTPException
-from ..services.db_loader import load_anime_data
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import List
+from ..services.db_loader import aget_anime_records, peek_catalog
+from ..services.http_cache import cached_response
 
 router = APIRouter()
 
-@router.get("/anime/{anime_id}")
-def get_anime(anime_id: int):
-    # Load data
-    data = load_anime_data()
+MAX_BATCH_IDS = 100
 
-    # Find anime by ID
-    for anime in data:
-        if anime["id"] == anime_id:
-            return anime
+@router.get("/anime")
+async def get_anime_batch(ids: List[str] = Query(..., description="Comma-separated anime IDs")):
+    # Hydrate several cards in one round trip; accepts ids=1,2,3 or repeated ids=
+    try:
+        id_list = [int(part) for value in ids for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be integers")
+    if len(id_list) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return await aget_anime_records(id_list)
 
-    # Not found
-    raise HTTPException(status_code=404, detail="Anime not found")
+@router.get("/anime/{anime_id}")
+async def get_anime(anime_id: int, request: Request):
+    found = await aget_anime_records([anime_id])
+    if not found:
+        raise HTTPException(status_code=404, detail="Anime not found")
+    return cached_response(request, peek_catalog(), lambda: found[0], key=f"anime:{anime_id}")
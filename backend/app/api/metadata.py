@@ -1,33 +1,13 @@
-from fastapi import APIRouter
-import time
-from ..services.db_loader import load_anime_data
+from fastapi import APIRouter, Request
+from ..services.db_loader import get_catalog
+from ..services.http_cache import cached_response
 
 router = APIRouter()
 
-_metadata_cache = {
-    "data": None,
-    "last_updated": 0
-}
-CACHE_TTL = 60  # seconds
-
-def _build_metadata():
-    data = load_anime_data()
-    total_entries = len(data)
-    last_updated = max(
-        (anime.get("last_updated") for anime in data if anime.get("last_updated")),
-        default=None
-    )
-    return {"total_entries": total_entries, "last_updated": last_updated}
-
 @router.get("/metadata")
-def get_metadata():
-    now = time.time()
-
-    if (
-        _metadata_cache["data"] is None
-        or now - _metadata_cache["last_updated"] > CACHE_TTL
-    ):
-        _metadata_cache["data"] = _build_metadata()
-        _metadata_cache["last_updated"] = now
-
-    return _metadata_cache["data"]
+def get_metadata(request: Request):
+    catalog = get_catalog()
+    return cached_response(request, catalog, lambda: {
+        "total_entries": catalog.total_entries,
+        "last_updated": catalog.last_updated
+    }, key="metadata")
@@ -1,50 +1,213 @@
-from fastapi import APIRouter, HTTPException
-from time import time
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import StreamingResponse
+import os
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import numpy as np
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI
 
-from ..models.schemas import RecommendRequest, ScoredAnime, Anime, RecommendReason
-from ..services.db_loader import load_anime_data, get_by_ids, get_by_titles
+from ..models.schemas import RecommendRequest, ScoredAnime
+from ..services.db_loader import aget_catalog, get_by_titles
 from ..services.openai_preference_parser import parse_preferences
-from ..recommender.hybrid_recommender import score_candidates
+from ..services.cache import LRUCache
+from ..services.openai_cache import openai_cache
+from ..services.fragments import join_array
+from ..recommender.hybrid_recommender import rank_candidates, page_ranking, score_profiles
+from ..recommender.vector_index import retrieve_candidates
+from ..recommender.neighbors import rank_neighbors
 
 router = APIRouter()
-_recommend_cache = {}
-CACHE_TTL = 60  # seconds
+CACHE_TTL = int(os.getenv("RECOMMEND_CACHE_TTL", "60"))  # seconds
+CACHE_SIZE = int(os.getenv("RECOMMEND_CACHE_SIZE", "1024"))  # entries
+_recommend_cache = LRUCache(max_entries=CACHE_SIZE, ttl=CACHE_TTL)
 
-client = OpenAI()
+# Session cursors: the ranked list behind a /recommend call, so "show more"
+# pages are cut from it instead of re-running OpenAI and re-scoring
+SESSION_TTL = int(os.getenv("RECOMMEND_SESSION_TTL", "900"))  # seconds
+SESSION_DEPTH = int(os.getenv("RECOMMEND_SESSION_DEPTH", "300"))  # ranked rows kept
+_sessions = LRUCache(max_entries=CACHE_SIZE, ttl=SESSION_TTL)
+
+client = AsyncOpenAI()
+EMBED_MODEL = "text-embedding-3-small"
+
+# CPU-bound stages (title resolution, retrieval, scoring) run here so they
+# neither block the event loop nor pile up beyond SCORING_WORKERS at once
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "4"))
+scoring_executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix="scoring")
+
+# Liked-only requests (no query, no moods) merge precomputed neighbour lists
+# when the snapshot has them instead of scoring the whole catalog
+NEIGHBOR_MODE = os.getenv("NEIGHBOR_MODE", "1") != "0"
+
+BATCH_MAX = int(os.getenv("RECOMMEND_BATCH_MAX", "10000"))  # profiles per /recommend/batch call
+BATCH_CHUNK = int(os.getenv("RECOMMEND_BATCH_CHUNK", "64"))  # profiles scored per matrix pass
 
 @router.post("/recommend", response_model=list[ScoredAnime])
-def recommend(req: RecommendRequest):
-    return _generate_recommendations(req, endpoint="recommend")
+async def recommend(req: RecommendRequest):
+    return await _generate_recommendations(req, endpoint="recommend")
 
 @router.post("/recommend/more", response_model=list[ScoredAnime])
-def recommend_more(req: RecommendRequest):
-    return _generate_recommendations(req, endpoint="recommend_more")
+async def recommend_more(req: RecommendRequest):
+    return await _generate_recommendations(req, endpoint="recommend_more")
+
+@router.post("/recommend/batch")
+async def recommend_batch(reqs: list[RecommendRequest]):
+    # Offline/bulk scoring: one NDJSON line per request, in order, as
+    # {"index": i, "recommendations": [...]} or {"index": i, "error": "..."}
+    if len(reqs) > BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX} requests per batch")
+    free_text = [i for i, r in enumerate(reqs) if r.query or r.semantic_query]
+    if free_text:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch requests cannot use free-text queries (indexes {free_text[:20]})"
+        )
+    catalog = await aget_catalog()
+    return StreamingResponse(_batch_lines(catalog, reqs), media_type="application/x-ndjson")
+
+@router.get("/recommend/cache")
+def recommend_cache_stats():
+    return {**_recommend_cache.stats(), "sessions": _sessions.stats()}
+
+def _normalize_text(text):
+    return " ".join(text.split()).lower() if text else None
+
+def _session_key(req: RecommendRequest) -> str:
+    # Everything that shapes the ranking; exclude_ids and limit only pick a page
+    # of it, so /recommend and the /recommend/more calls after it share a key
+    return json.dumps({
+        "liked_ids": sorted(set(req.liked_ids)),
+        "disliked_ids": sorted(set(req.disliked_ids)),
+        "moods": sorted({_normalize_text(m) for m in req.moods if m and m.strip()}),
+        "nsfw_ok": req.nsfw_ok,
+        "query": _normalize_text(req.query),
+        "semantic_query": _normalize_text(req.semantic_query),
+    }, separators=(",", ":"))
+
+def _cache_key(req: RecommendRequest, endpoint: str) -> str:
+    # Requests that only differ in list order, duplicates, casing or spacing share a key
+    return json.dumps({
+        "endpoint": endpoint,
+        "session": _session_key(req),
+        "exclude_ids": sorted(set(req.exclude_ids)),
+        "limit": req.limit,
+    }, separators=(",", ":"))
+
+async def _embed_query(text: str) -> np.ndarray:
+    # Persistent cache first; only unseen texts cost an embeddings call
+    key = openai_cache.key("embedding", EMBED_MODEL, text)
+    vec = await openai_cache.aget_embedding(key)
+    if vec is None:
+        try:
+            response = await client.embeddings.create(model=EMBED_MODEL, input=text)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Embedding failed: {e}")
+        vec = np.array(response.data[0].embedding, dtype=np.float32)
+        await openai_cache.aset_embedding(key, vec)
+
+    # TEMP LOG
+    print(f"Query embedding length: {len(vec)}", flush=True)
+    return vec
+
+async def _run_cpu(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(scoring_executor, partial(fn, *args, **kwargs))
+
+async def _no_embedding():
+    return None
+
+REASON_NOTE = "Matched using tag overlap, liked anime similarity, and query similarity."
+
+def _render(catalog, scored) -> bytes:
+    # list[ScoredAnime] as JSON: each anime's cached fragment plus this
+    # request's score and overlap, skipping per-request model validation
+    return join_array(
+        b'{"anime":' + catalog.fragments.anime(catalog.row_of[anime["id"]])
+        + b',"score":' + orjson.dumps(round(float(score), 4))
+        + b',"reason":' + orjson.dumps({"overlap_tags": overlap, "note": REASON_NOTE})
+        + b"}"
+        for anime, score, overlap in scored
+    )
 
-def _generate_recommendations(req: RecommendRequest, endpoint: str):
-    cache_key = f"{endpoint}:{json.dumps(req.dict(), sort_keys=True)}"
-    now = time()
+def _json_response(body: bytes) -> Response:
+    # Bypasses response_model, which would re-validate the pre-built body
+    return Response(body, media_type="application/json")
 
-    if cache_key in _recommend_cache:
-        ts, cached_result = _recommend_cache[cache_key]
-        if now - ts < CACHE_TTL:
-            return cached_result
+def _batch_lines(catalog, reqs: list[RecommendRequest]):
+    # Sync generator (Starlette runs it in a worker thread); only BATCH_CHUNK
+    # profiles' score columns are alive at once, so memory stays bounded
+    for start in range(0, len(reqs), BATCH_CHUNK):
+        chunk = reqs[start:start + BATCH_CHUNK]
+        errors, profiles = {}, {}
+        for offset, req in enumerate(chunk):
+            invalid_ids = [i for i in req.liked_ids + req.disliked_ids if i not in catalog.by_id]
+            if invalid_ids:
+                errors[offset] = f"Invalid anime IDs: {invalid_ids}"
+                continue
+            profiles[offset] = {
+                "liked_ids": req.liked_ids,
+                "disliked_ids": req.disliked_ids,
+                "moods": req.moods,
+                "nsfw_ok": req.nsfw_ok,
+                "exclude_ids": set(req.liked_ids) | set(req.disliked_ids) | set(req.exclude_ids),
+                "limit": req.limit,
+            }
 
-    all_anime = load_anime_data()
-    all_ids = {a["id"] for a in all_anime}
+        scored = dict(zip(profiles, score_profiles(
+            catalog, list(profiles.values()), tag_weight=0.35, liked_weight=0.25
+        )))
+        for offset in range(len(chunk)):
+            if offset in errors:
+                yield orjson.dumps({"index": start + offset, "error": errors[offset]}) + b"\n"
+            else:
+                yield (
+                    b'{"index":' + str(start + offset).encode()
+                    + b',"recommendations":' + _render(catalog, scored[offset]) + b"}\n"
+                )
+
+async def _generate_recommendations(req: RecommendRequest, endpoint: str):
+    catalog = await aget_catalog()
+    cache_key = _cache_key(req, endpoint)
+
+    cached_result = _recommend_cache.get(cache_key, version=catalog.version)
+    if cached_result is not None:
+        return _json_response(cached_result)
+
+    # Later pages of an earlier request: filter its ranking, no OpenAI calls
+    session_key = _session_key(req)
+    ranking = _sessions.get(session_key, version=catalog.version)
+    if ranking is not None:
+        page = page_ranking(catalog, ranking, req.exclude_ids, req.limit)
+        if page is not None:
+            body = _render(catalog, page)
+            _recommend_cache.set(cache_key, body, version=catalog.version)
+            # TEMP LOG
+            print(f"Returned {len(page)} recommendations from session cursor", flush=True)
+            return _json_response(body)
+
+    all_ids = catalog.by_id
 
     # ------------ Handle free-text query with OpenAI ------------
+    query_embedding = None
     if req.query:
-        parsed = parse_preferences(req.query, nsfw_ok=req.nsfw_ok)
+        parsed = await parse_preferences(req.query, nsfw_ok=req.nsfw_ok)
 
         # TEMP LOGS
         print("=== Parsed Preferences ===", flush=True)
         print(json.dumps(parsed, indent=2), flush=True)
 
-        liked_ids_from_titles = get_by_titles(parsed.get("liked_titles", []))
-        disliked_ids_from_titles = get_by_titles(parsed.get("disliked_titles", []))
+        req.semantic_query = " ".join(parsed.get("semantic_moods", []))
+
+        # Title resolution and the query embedding only depend on the parse,
+        # so they run side by side
+        liked_ids_from_titles, disliked_ids_from_titles, query_embedding = await asyncio.gather(
+            _run_cpu(get_by_titles, parsed.get("liked_titles", [])),
+            _run_cpu(get_by_titles, parsed.get("disliked_titles", [])),
+            _embed_query(req.semantic_query) if req.semantic_query else _no_embedding(),
+        )
 
         # TEMP LOGS
         print(f"Liked title matches → {liked_ids_from_titles}", flush=True)
@@ -53,7 +216,6 @@ def _generate_recommendations(req: RecommendRequest, endpoint: str):
         req.liked_ids = list(set(req.liked_ids + liked_ids_from_titles))
         req.disliked_ids = list(set(req.disliked_ids + disliked_ids_from_titles))
         req.moods = list(set(req.moods + parsed.get("mapped_tags", [])))
-        req.semantic_query = " ".join(parsed.get("semantic_moods", []))
 
         # TEMP LOG
         print(f"Final semantic query: '{req.semantic_query}'", flush=True)
@@ -66,60 +228,48 @@ def _generate_recommendations(req: RecommendRequest, endpoint: str):
             detail=f"Invalid anime IDs: {invalid_ids}"
         )
 
-    # Remove excluded titles from candidates
-    exclude_ids = set(req.liked_ids) | set(req.disliked_ids) | set(req.exclude_ids)
-    candidates = [a for a in all_anime if a["id"] not in exclude_ids]
-
-    liked = get_by_ids(req.liked_ids)
-    disliked = get_by_ids(req.disliked_ids)
-
     # ----------- Query Embedding (via OpenAI embeddings) ------------
-    query_embedding = None
-    if req.semantic_query:
-        try:
-            response = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=req.semantic_query
-            )
-            query_embedding = np.array(response.data[0].embedding, dtype=float)
+    if query_embedding is None and req.semantic_query:
+        query_embedding = await _embed_query(req.semantic_query)
 
-            # TEMP LOG
-            print(f"Query embedding length: {len(query_embedding)}", flush=True)
+    # Approximate neighbours of the query, re-ranked exactly below
+    candidate_rows = await _run_cpu(retrieve_candidates, catalog, query_embedding)
 
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Embedding failed: {e}")
-
-    scored = score_candidates(
-        all_items=candidates,
-        liked=liked,
-        disliked=disliked,
-        moods=req.moods,
-        nsfw_ok=req.nsfw_ok,
-        query_embedding=query_embedding,
-        tag_weight=0.35,
-        liked_weight=0.25,
-        query_weight=0.40
-    )
-
-    response: list[ScoredAnime] = []
-    for anime, score, overlap in scored[:req.limit]:
-        response.append(
-            ScoredAnime(
-                anime=Anime(**{k: anime.get(k) for k in [
-                    "id", "title", "all_titles", "main_picture", "tags", "synopsis",
-                    "rating", "is_nsfw", "total_episodes"
-                ]}),
-                score=round(float(score), 4),
-                reason=RecommendReason(
-                    overlap_tags=overlap,
-                    note="Matched using tag overlap, liked anime similarity, and query similarity."
-                )
-            )
+    # Rank deep enough for the requested exclusions plus a few "more" pages;
+    # liked/disliked titles are always excluded, exclude_ids only filter pages
+    ranking = None
+    if (NEIGHBOR_MODE and catalog.neighbors is not None and req.liked_ids
+            and not req.moods and query_embedding is None):
+        ranking = await _run_cpu(
+            rank_neighbors, catalog, req.liked_ids, req.disliked_ids, req.nsfw_ok
+        )
+        scored = page_ranking(catalog, ranking, req.exclude_ids, req.limit)
+        if scored is None:
+            # The neighbour pool ran dry for this page, score the whole catalog
+            ranking = None
+    if ranking is None:
+        ranking = await _run_cpu(
+            rank_candidates,
+            catalog,
+            liked_ids=req.liked_ids,
+            disliked_ids=req.disliked_ids,
+            moods=req.moods,
+            nsfw_ok=req.nsfw_ok,
+            exclude_ids=set(req.liked_ids) | set(req.disliked_ids),
+            query_embedding=query_embedding,
+            tag_weight=0.35,
+            liked_weight=0.25,
+            query_weight=0.40,
+            depth=max(SESSION_DEPTH, len(set(req.exclude_ids)) + req.limit),
+            candidate_rows=candidate_rows
         )
+        scored = page_ranking(catalog, ranking, req.exclude_ids, req.limit)
+    _sessions.set(session_key, ranking, version=catalog.version)
 
-    _recommend_cache[cache_key] = (now, response)
+    body = _render(catalog, scored)
+    _recommend_cache.set(cache_key, body, version=catalog.version)
 
     # TEMP LOG
-    print(f"Returned {len(response)} recommendations", flush=True)
+    print(f"Returned {len(scored)} recommendations", flush=True)
 
-    return response
+    return _json_response(body)
@@ -1,54 +1,29 @@
-from fastapi import APIRouter, Query
-from typing import List
-from ..services.db_loader import load_anime_data
+from fastapi import APIRouter, Query, Request
+from ..services.db_loader import get_catalog
+from ..services.http_cache import cached_response
+from ..services.fragments import join_array
 
 router = APIRouter()
 
 @router.get("/search")
 def search(
+    request: Request,
     q: str = Query(""),
     limit: int = 10,
     nsfw_ok: bool = Query(False, description="Include NSFW results")
-) -> List[dict]:
+):
     q_lower = q.strip().lower()
     if not q_lower:
         return []
 
-    data = load_anime_data()
-
-    prefix_matches = []
-    substring_matches = []
-
-    for anime in data:
-        # Skip NSFW if not allowed
-        if not nsfw_ok and anime.get("is_nsfw"):
-            continue
-        if nsfw_ok and not anime.get("is_nsfw") and False:  # no skip, just example for other filter
-            pass
-
-        titles = [anime.get("title", "")] + anime.get("all_titles", [])
-        titles_lower = [t.lower() for t in titles if t]
-
-        if any(t.startswith(q_lower) for t in titles_lower):
-            prefix_matches.append(anime)
-        elif any(q_lower in t for t in titles_lower):
-            substring_matches.append(anime)
-
-    results = prefix_matches + substring_matches
-
-    formatted_results = [
-    {
-        "id": a["id"],
-        "title": a.get("title"),
-        "all_titles": a.get("all_titles", []),
-        "main_picture": a.get("main_picture"),
-        "tags": a.get("tags", []),
-        "synopsis": a.get("synopsis"),
-        "total_episodes": a.get("total_episodes"),
-        "is_nsfw": a.get("is_nsfw", False)
-    }
-    for a in results
-]
-
-
-    return formatted_results[:limit]
+    catalog = get_catalog()
+    return cached_response(
+        request, catalog, lambda: _search(catalog, q_lower, limit, nsfw_ok),
+        key=f"search:{nsfw_ok}:{limit}:{q_lower}"
+    )
+
+def _search(catalog, q_lower: str, limit: int, nsfw_ok: bool) -> bytes:
+    # Prefix matches first, then substring matches, straight from the title index;
+    # each row's projection is serialized once per catalog version
+    rows = catalog.titles.search(q_lower, nsfw_ok, limit)
+    return join_array(catalog.fragments.search(row) for row in rows)
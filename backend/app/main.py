@@ -1,10 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .api import recommend, search, anime, tags, metadata, config
+from .services.db_loader import apool, start_catalog_listener
 from dotenv import load_dotenv
 load_dotenv()
 
-app = FastAPI(title="Anime Recommender API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await apool.open(wait=False)
+    listener = start_catalog_listener()
+    yield
+    if listener is not None:
+        listener.set()
+    await apool.close()
+    recommend.scoring_executor.shutdown(wait=False)
+
+app = FastAPI(title="Anime Recommender API", version="0.1.0", lifespan=lifespan)
 
 origins = [
     "https://animerecommend.com", 
@@ -1,79 +1,228 @@
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Iterable, Optional, NamedTuple
 import numpy as np
 
-def _tags(anime: Dict[str, Any]) -> Set[str]:
-    return {t.lower() for t in (anime.get("tags") or [])}
-
-def _cosine_sim(v1: list[float], v2: list[float]) -> float:
-    v1 = np.array(v1)
-    v2 = np.array(v2)
-    denom = (np.linalg.norm(v1) * np.linalg.norm(v2))
-    return float(np.dot(v1, v2) / denom) if denom else 0.0
+class Ranking(NamedTuple):
+    rows: np.ndarray        # qualifying catalog rows, best first
+    scores: np.ndarray      # their raw (unnormalized) scores
+    liked_mask: np.ndarray  # liked-tag mask for overlap explanations
+    complete: bool          # False when cut at a depth, i.e. more rows qualified
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def _direction(catalog, liked_rows: List[int], query_embedding, liked_weight: float, query_weight: float) -> np.ndarray:
+    # Both cosine terms collapse into one weighted direction, so the whole
+    # catalog is scored with a single matrix-vector product.
+    direction = np.zeros(catalog.embeddings.shape[1], dtype=np.float32)
+
+    liked_rows = [r for r in liked_rows if catalog.has_embedding[r]]
+    if liked_rows:
+        direction += liked_weight * _unit(catalog.embeddings[liked_rows].mean(axis=0))
+
+    if query_embedding is not None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape != direction.shape:
+            raise ValueError(f"Query embedding has {query.shape[0]} dims, catalog uses {direction.shape[0]}")
+        direction += query_weight * _unit(query)
+    return direction
+
+def _semantic_scores(catalog, liked_rows: List[int], query_embedding, liked_weight: float, query_weight: float) -> np.ndarray:
+    direction = _direction(catalog, liked_rows, query_embedding, liked_weight, query_weight)
+    if not direction.any():
+        return np.zeros(len(catalog.items), dtype=np.float32)
+    return catalog.embeddings @ direction
+
+def _tag_weights(catalog, liked_rows: List[int], disliked_rows: List[int], moods: List[str]):
+    # Per-tag weight so that a row's tag score is just the sum over its tags:
+    # liked overlap share, minus the dislike penalty, plus the mood boost.
+    index = catalog.tags
+    liked_pool = index.union(liked_rows)
+    disliked_pool = index.union(disliked_rows)
+
+    weights = np.zeros(index.n_tags, dtype=np.float64)
+    if len(liked_pool):
+        weights[liked_pool] += 1.0 / len(liked_pool)
+    weights[disliked_pool] -= 0.15
+    weights[index.lookup(moods)] += 0.05
+
+    liked_mask = np.zeros(index.n_tags, dtype=bool)
+    liked_mask[liked_pool] = True
+    return weights, liked_mask
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # Positions of the k best scores, best first (ties keep catalog order)
+    if k < len(scores):
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        picked = np.concatenate([above, ties])
+    else:
+        picked = np.arange(len(scores))
+    return picked[np.lexsort((picked, -scores[picked]))]
+
+def _rank(
+    catalog,
+    final: np.ndarray,
+    liked_mask: np.ndarray,
+    nsfw_ok: bool,
+    exclude_ids: Iterable[int] = (),
+    depth: Optional[int] = None,
+    candidate_rows: Optional[np.ndarray] = None
+) -> Ranking:
+    # Untagged, NSFW (unless allowed) and excluded rows never qualify
+    eligible = catalog.tags.counts > 0
+    if not nsfw_ok:
+        eligible &= ~catalog.is_nsfw
+    excluded_rows = [catalog.row_of[i] for i in exclude_ids if i in catalog.row_of]
+    eligible[excluded_rows] = False
+    if candidate_rows is not None:
+        pooled = np.zeros(len(eligible), dtype=bool)
+        pooled[candidate_rows] = True
+        eligible &= pooled
+
+    rows = np.flatnonzero(eligible & (final > 0))
+
+    # Partial selection of the best `depth` rows
+    k = len(rows) if depth is None else min(len(rows), depth)
+    ranked = rows[_top_k(final[rows], k)] if k else rows[:0]
+    return Ranking(ranked, final[ranked], liked_mask, k == len(rows))
+
+def _explain(catalog, rows: np.ndarray, scores: np.ndarray, best: float, liked_mask: np.ndarray):
+    return [
+        (catalog.items[r], float(s), catalog.tags.overlap(r, liked_mask))
+        for r, s in zip(rows.tolist(), (scores / best).tolist())
+    ]
+
+def _select(
+    catalog,
+    final: np.ndarray,
+    liked_mask: np.ndarray,
+    nsfw_ok: bool,
+    exclude_ids: Iterable[int] = (),
+    limit: Optional[int] = None,
+    offset: int = 0,
+    candidate_rows: Optional[np.ndarray] = None
+) -> List[tuple[Dict[str, Any], float, list[str]]]:
+    ranking = _rank(
+        catalog, final, liked_mask, nsfw_ok, exclude_ids,
+        None if limit is None else offset + limit, candidate_rows
+    )
+    if len(ranking.rows) <= offset:
+        return []
+    # Only the returned slice is normalized and explained
+    return _explain(
+        catalog, ranking.rows[offset:], ranking.scores[offset:], ranking.scores[0], liked_mask
+    )
+
+def _final_scores(catalog, liked_ids, disliked_ids, moods, query_embedding, tag_weight, liked_weight, query_weight):
+    liked_rows = [catalog.row_of[i] for i in liked_ids if i in catalog.row_of]
+    disliked_rows = [catalog.row_of[i] for i in disliked_ids if i in catalog.row_of]
+
+    # Tag score for every row through the sparse incidence matrix
+    weights, liked_mask = _tag_weights(catalog, liked_rows, disliked_rows, moods)
+    tag_score = catalog.tags.dot(weights)
+
+    # Liked-centroid and query similarity for every row
+    semantic = _semantic_scores(catalog, liked_rows, query_embedding, liked_weight, query_weight)
+
+    return tag_score * tag_weight + semantic, liked_mask
 
 def score_candidates(
-    all_items: List[Dict[str, Any]],
-    liked: List[Dict[str, Any]],
-    disliked: List[Dict[str, Any]],
+    catalog,
+    liked_ids: List[int],
+    disliked_ids: List[int],
     moods: List[str],
     nsfw_ok: bool,
+    exclude_ids: Iterable[int] = (),
     query_embedding=None,
     tag_weight: float = 0.25,
     liked_weight: float = 0.25,
-    query_weight: float = 0.40
+    query_weight: float = 0.40,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    candidate_rows: Optional[np.ndarray] = None
 ) -> List[tuple[Dict[str, Any], float, list[str]]]:
-
-    mood_set = {m.lower() for m in moods}
-    liked_tag_pool = set().union(*[_tags(a) for a in liked]) if liked else set()
-    disliked_tag_pool = set().union(*[_tags(a) for a in disliked]) if disliked else set()
-
-    # Average embedding for liked anime
-    liked_embeddings = [a.get("embedding") for a in liked if a.get("embedding")]
-    avg_liked_emb = np.mean(liked_embeddings, axis=0) if liked_embeddings else None
-
-    out = []
-    for anime in all_items:
-        if (not nsfw_ok) and anime.get("is_nsfw"):
-            continue
-
-        tags = _tags(anime)
-        if not tags:
-            continue
-
-        # Tag score
-        overlap = liked_tag_pool & tags
-        tag_score = len(overlap) / len(liked_tag_pool) if liked_tag_pool else 0.0
-
-        bad_overlap = disliked_tag_pool & tags
-        tag_score -= 0.15 * len(bad_overlap)
-
-        # Mood boost
-        tag_score += 0.05 * len({m for m in mood_set if m in tags})
-
-        # Liked anime synopsis score
-        liked_synopsis_score = 0.0
-        if avg_liked_emb is not None and anime.get("embedding"):
-            liked_synopsis_score = _cosine_sim(avg_liked_emb, anime["embedding"])
-
-        # Query synopsis score
-        query_synopsis_score = 0.0
-        if query_embedding is not None and anime.get("embedding"):
-            query_synopsis_score = _cosine_sim(query_embedding, anime["embedding"])
-
-        # Blend scores
-        final_score = (
-            (tag_score * tag_weight) +
-            (liked_synopsis_score * liked_weight) +
-            (query_synopsis_score * query_weight)
+    # Returns ranks [offset, offset + limit) (everything when limit is None),
+    # scores normalized against the overall best match. candidate_rows, e.g. a
+    # vector-index pool, restricts which rows may be returned.
+    final, liked_mask = _final_scores(
+        catalog, liked_ids, disliked_ids, moods, query_embedding, tag_weight, liked_weight, query_weight
+    )
+    return _select(catalog, final, liked_mask, nsfw_ok, exclude_ids, limit, offset, candidate_rows)
+
+def rank_candidates(
+    catalog,
+    liked_ids: List[int],
+    disliked_ids: List[int],
+    moods: List[str],
+    nsfw_ok: bool,
+    exclude_ids: Iterable[int] = (),
+    query_embedding=None,
+    tag_weight: float = 0.25,
+    liked_weight: float = 0.25,
+    query_weight: float = 0.40,
+    depth: Optional[int] = None,
+    candidate_rows: Optional[np.ndarray] = None
+) -> Ranking:
+    # Same scoring as score_candidates, but keeps the best `depth` rows with
+    # raw scores so later pages can be cut from it by page_ranking
+    final, liked_mask = _final_scores(
+        catalog, liked_ids, disliked_ids, moods, query_embedding, tag_weight, liked_weight, query_weight
+    )
+    return _rank(catalog, final, liked_mask, nsfw_ok, exclude_ids, depth, candidate_rows)
+
+def page_ranking(
+    catalog,
+    ranking: Ranking,
+    exclude_ids: Iterable[int],
+    limit: int
+) -> Optional[List[tuple[Dict[str, Any], float, list[str]]]]:
+    # The best `limit` rows of a ranking once exclude_ids are filtered out,
+    # normalized like score_candidates with those ids excluded. None when a
+    # truncated ranking runs out and the caller has to score again.
+    rows, scores = ranking.rows, ranking.scores
+    excluded_rows = [catalog.row_of[i] for i in exclude_ids if i in catalog.row_of]
+    if excluded_rows:
+        keep = ~np.isin(rows, excluded_rows)
+        rows, scores = rows[keep], scores[keep]
+    if len(rows) < limit and not ranking.complete:
+        return None
+    if not len(rows) or limit <= 0:
+        return []
+    return _explain(catalog, rows[:limit], scores[:limit], scores[0], ranking.liked_mask)
+
+def score_profiles(
+    catalog,
+    profiles: List[Dict[str, Any]],
+    tag_weight: float = 0.25,
+    liked_weight: float = 0.25
+) -> List[List[tuple[Dict[str, Any], float, list[str]]]]:
+    # score_candidates for many profiles without free text. Each profile holds
+    # liked_ids, disliked_ids, moods, nsfw_ok and optionally exclude_ids/limit.
+    # Tag weights and liked directions are stacked column-wise so the catalog
+    # is scored for every profile with one sparse and one dense matrix product.
+    if not profiles:
+        return []
+
+    weights, masks, directions = [], [], []
+    for profile in profiles:
+        liked_rows = [catalog.row_of[i] for i in profile.get("liked_ids", []) if i in catalog.row_of]
+        disliked_rows = [catalog.row_of[i] for i in profile.get("disliked_ids", []) if i in catalog.row_of]
+        w, mask = _tag_weights(catalog, liked_rows, disliked_rows, profile.get("moods", []))
+        weights.append(w)
+        masks.append(mask)
+        directions.append(_direction(catalog, liked_rows, None, liked_weight, 0.0))
+
+    final = catalog.tags.dot(np.stack(weights, axis=1)) * tag_weight
+    directions = np.stack(directions, axis=1)
+    if directions.any():
+        final += catalog.embeddings @ directions
+
+    return [
+        _select(
+            catalog, final[:, j], masks[j], profile.get("nsfw_ok", False),
+            profile.get("exclude_ids", ()), profile.get("limit")
         )
-
-        if final_score > 0:
-            out.append((anime, final_score, sorted(overlap)))
-
-    # Normalize scores
-    if out:
-        max_score = max(s for _, s, _ in out)
-        if max_score > 0:
-            out = [(a, s / max_score, ol) for a, s, ol in out]
-
-    out.sort(key=lambda x: x[1], reverse=True)
-    return out
+        for j, profile in enumerate(profiles)
+    ]
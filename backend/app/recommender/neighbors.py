@@ -0,0 +1,89 @@
+import os
+from typing import List, Iterable, NamedTuple
+import numpy as np
+from dotenv import load_dotenv
+from .hybrid_recommender import Ranking
+load_dotenv()
+
+NEIGHBOR_K = int(os.getenv("NEIGHBOR_K", "50"))                           # neighbours kept per anime
+NEIGHBOR_COSINE_WEIGHT = float(os.getenv("NEIGHBOR_COSINE_WEIGHT", "0.7"))  # rest goes to tag Jaccard
+NEIGHBOR_DISLIKE_WEIGHT = float(os.getenv("NEIGHBOR_DISLIKE_WEIGHT", "0.5"))
+NEIGHBOR_BLOCK = 512  # rows scored per block while building, bounds memory to block x N
+
+class NeighborLists(NamedTuple):
+    rows: np.ndarray    # (N, K) int32 neighbour rows, best first
+    scores: np.ndarray  # (N, K) float32 blended similarity
+
+def build_neighbors(catalog, k: int = NEIGHBOR_K, cosine_weight: float = NEIGHBOR_COSINE_WEIGHT) -> NeighborLists:
+    # Top-k rows per row by cosine_weight * embedding cosine + (1 - cosine_weight)
+    # * tag Jaccard, computed block by block against the whole catalog
+    n = len(catalog.items)
+    k = max(0, min(k, n - 1))
+    index = catalog.tags
+    incidence = np.zeros((n, index.n_tags), dtype=np.float32)
+    incidence[np.repeat(np.arange(n), index.counts), index.indices] = 1.0
+    counts = index.counts.astype(np.float32)
+
+    rows = np.zeros((n, k), dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    for start in range(0, n, NEIGHBOR_BLOCK):
+        block = slice(start, min(start + NEIGHBOR_BLOCK, n))
+        cosine = np.asarray(catalog.embeddings[block] @ catalog.embeddings.T)
+        inter = incidence[block] @ incidence.T
+        union = counts[block, None] + counts[None, :] - inter
+        jaccard = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        sims = cosine_weight * cosine + (1 - cosine_weight) * jaccard
+        sims[np.arange(sims.shape[0]), np.arange(block.start, block.stop)] = -np.inf  # never yourself
+
+        if k:
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1, kind="stable")
+            rows[block] = np.take_along_axis(top, order, axis=1)
+            scores[block] = np.take_along_axis(top_sims, order, axis=1)
+    return NeighborLists(rows, scores)
+
+def rank_neighbors(
+    catalog,
+    liked_ids: List[int],
+    disliked_ids: List[int],
+    nsfw_ok: bool,
+    exclude_ids: Iterable[int] = (),
+    dislike_weight: float = NEIGHBOR_DISLIKE_WEIGHT
+) -> Ranking:
+    # Liked-only recommendations from the precomputed lists: mean similarity to
+    # the liked titles over their merged neighbours, minus dislike_weight times
+    # the mean similarity to the disliked titles. Costs O(K * |liked|), not O(N).
+    # The pool is only those neighbours, so the ranking is never complete and a
+    # page it cannot fill is left to full scoring.
+    neighbors = catalog.neighbors
+    liked_rows = [catalog.row_of[i] for i in liked_ids if i in catalog.row_of]
+    disliked_rows = [catalog.row_of[i] for i in disliked_ids if i in catalog.row_of]
+
+    candidates, inverse = np.unique(neighbors.rows[liked_rows].ravel(), return_inverse=True)
+    scores = np.bincount(inverse, weights=neighbors.scores[liked_rows].ravel(), minlength=len(candidates))
+    scores /= max(1, len(liked_rows))
+
+    if disliked_rows:
+        near = neighbors.rows[disliked_rows].ravel()
+        hit = np.isin(near, candidates)
+        penalty = np.zeros(len(candidates))
+        np.add.at(
+            penalty, np.searchsorted(candidates, near[hit]),
+            neighbors.scores[disliked_rows].ravel()[hit]
+        )
+        scores -= dislike_weight * penalty / len(disliked_rows)
+
+    # Same eligibility as score_candidates
+    eligible = catalog.tags.counts[candidates] > 0
+    if not nsfw_ok:
+        eligible &= ~catalog.is_nsfw[candidates]
+    excluded = set(liked_rows) | set(disliked_rows) | {catalog.row_of[i] for i in exclude_ids if i in catalog.row_of}
+    eligible &= ~np.isin(candidates, list(excluded))
+    eligible &= scores > 0
+    candidates, scores = candidates[eligible], scores[eligible]
+
+    order = np.lexsort((candidates, -scores))
+    liked_mask = np.zeros(catalog.tags.n_tags, dtype=bool)
+    liked_mask[catalog.tags.union(liked_rows)] = True
+    return Ranking(candidates[order].astype(np.int64), scores[order], liked_mask, False)
@@ -0,0 +1,232 @@
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import NamedTuple, Optional
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+# Backend for query-embedding retrieval: none | bruteforce | ivf | pgvector
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "none").lower()
+VECTOR_CANDIDATES = int(os.getenv("VECTOR_CANDIDATES", "500"))  # pool size re-ranked by score_candidates
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))                   # 0 = sqrt(N)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_ITERATIONS = int(os.getenv("IVF_ITERATIONS", "10"))
+PGVECTOR_PROBES = int(os.getenv("PGVECTOR_PROBES", "0"))       # ivfflat.probes / hnsw.ef_search, 0 = server default
+
+INDEX_DIR = Path(__file__).resolve().parents[1] / "data" / "vector_index"
+
+def _top_rows(rows: np.ndarray, sims: np.ndarray, k: int) -> np.ndarray:
+    if k < len(rows):
+        keep = np.argpartition(-sims, k - 1)[:k]
+        rows, sims = rows[keep], sims[keep]
+    return rows[np.argsort(-sims, kind="stable")]
+
+def _unit_query(query) -> np.ndarray:
+    q = np.asarray(query, dtype=np.float32)
+    norm = np.linalg.norm(q)
+    return q / norm if norm else q
+
+
+class BruteForceIndex:
+    """Exact cosine search over the snapshot's embedding matrix."""
+
+    name = "bruteforce"
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.rows = np.flatnonzero(catalog.has_embedding)
+
+    def search(self, query, k: int) -> np.ndarray:
+        q = _unit_query(query)
+        sims = self.catalog.embeddings[self.rows] @ q
+        return _top_rows(self.rows, sims, k)
+
+
+class IVFLists(NamedTuple):
+    centroids: np.ndarray   # (nlist, dim) float32 unit centroids
+    assignment: np.ndarray  # (N,) int32 list of every row, -1 without an embedding
+
+def _nlist_for(n_rows: int, nlist: int = IVF_NLIST) -> int:
+    nlist = nlist or max(1, int(np.sqrt(n_rows)))
+    return min(nlist, max(1, n_rows))
+
+def _train(X: np.ndarray, nlist: int):
+    rng = np.random.default_rng(0)
+    centroids = X[rng.choice(len(X), nlist, replace=False)].copy()
+    assignment = np.zeros(len(X), dtype=np.int32)
+    for _ in range(IVF_ITERATIONS):
+        assignment = np.argmax(X @ centroids.T, axis=1).astype(np.int32)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, X)
+        norms = np.linalg.norm(sums, axis=1)
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids, assignment
+
+def build_ivf(catalog, nlist: int = IVF_NLIST) -> Optional[IVFLists]:
+    # Spherical k-means over the embedded rows; None for a catalog without embeddings
+    rows = np.flatnonzero(catalog.has_embedding)
+    if not len(rows):
+        return None
+    centroids, assignment = _train(np.asarray(catalog.embeddings[rows]), _nlist_for(len(rows), nlist))
+    full = np.full(len(catalog.ids), -1, dtype=np.int32)
+    full[rows] = assignment
+    return IVFLists(centroids.astype(np.float32), full)
+
+
+class IVFIndex:
+    """Inverted-file index: spherical k-means centroids with one posting list each.
+
+    A search scores the ``nprobe`` closest centroids and then only the rows in
+    their posting lists. The clustering is trained by ``export_catalog_snapshot``
+    and loaded with the snapshot; a catalog without one (or with another
+    ``nlist``) is clustered here once and saved under ``INDEX_DIR`` so other
+    workers and restarts can load it instead of re-clustering.
+    """
+
+    name = "ivf"
+
+    def __init__(self, catalog, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE):
+        self.catalog = catalog
+        self.nprobe = nprobe
+        rows = np.flatnonzero(catalog.has_embedding)
+
+        lists = getattr(catalog, "ivf", None)
+        if lists is not None and nlist and len(lists.centroids) != nlist:
+            lists = None
+        if lists is None:
+            self.nlist = _nlist_for(len(rows), nlist)
+            lists = self._load()
+        if lists is None:
+            lists = build_ivf(catalog, self.nlist)
+            if lists is None:
+                raise ValueError("catalog has no embeddings to cluster")
+            self._save(lists)
+        self.nlist = len(lists.centroids)
+        self.centroids = lists.centroids
+        self._set_lists(rows, lists.assignment[rows])
+
+    def _path(self) -> Path:
+        return INDEX_DIR / f"ivf_{self.catalog.version}_{self.nlist}.npz"
+
+    def _set_lists(self, rows: np.ndarray, assignment: np.ndarray):
+        order = np.argsort(assignment, kind="stable")
+        self.list_rows = rows[order]
+        self.list_offsets = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+
+    def _load(self) -> Optional[IVFLists]:
+        path = self._path()
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as saved:
+                if not np.array_equal(saved["ids"], self.catalog.ids):
+                    return None
+                return IVFLists(saved["centroids"], saved["assignment"])
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable vector index {path}: {e}", flush=True)
+            return None
+
+    def _save(self, lists: IVFLists):
+        # Written under a name unique to this process, then renamed into place,
+        # so workers clustering the same version at once never mix their files
+        tmp = None
+        try:
+            INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=f".{self._path().stem}.", suffix=".npz", dir=INDEX_DIR)
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, centroids=lists.centroids, assignment=lists.assignment, ids=self.catalog.ids)
+            os.replace(tmp, self._path())
+        except OSError as e:
+            print(f"[WARN] Could not persist vector index: {e}", flush=True)
+            if tmp is not None:
+                Path(tmp).unlink(missing_ok=True)
+
+    def search(self, query, k: int) -> np.ndarray:
+        q = _unit_query(query)
+        probes = np.argsort(-(self.centroids @ q))[:self.nprobe]
+        rows = np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes
+        ])
+        if not len(rows):
+            return rows
+        sims = self.catalog.embeddings[rows] @ q
+        return _top_rows(rows, sims, k)
+
+
+class PgVectorIndex:
+    """Nearest neighbours straight from Postgres via pgvector's cosine distance.
+
+    Needs the ``embedding`` column to be a pgvector ``vector``; falls back to an
+    exact in-process search if the query fails.
+    """
+
+    name = "pgvector"
+
+    def __init__(self, catalog, probes: int = PGVECTOR_PROBES):
+        self.catalog = catalog
+        self.probes = probes
+        self.fallback = BruteForceIndex(catalog)
+
+    def search(self, query, k: int) -> np.ndarray:
+        from ..services.db_loader import pool
+
+        literal = "[" + ",".join(f"{x:.7g}" for x in np.asarray(query, dtype=np.float32)) + "]"
+        try:
+            with pool.connection() as conn:
+                with conn.transaction():
+                    if self.probes:
+                        conn.execute(f"SET LOCAL ivfflat.probes = {int(self.probes)}")
+                        conn.execute(f"SET LOCAL hnsw.ef_search = {int(self.probes)}")
+                    rows = conn.execute("""
+                        SELECT id FROM anime
+                        WHERE embedding IS NOT NULL
+                        ORDER BY embedding <=> %s::vector
+                        LIMIT %s
+                    """, (literal, k)).fetchall()
+        except Exception as e:
+            print(f"[WARN] pgvector search failed, using brute force: {e}", flush=True)
+            return self.fallback.search(query, k)
+
+        row_of = self.catalog.row_of
+        return np.array([row_of[r["id"]] for r in rows if r["id"] in row_of], dtype=np.int64)
+
+
+_BACKENDS = {
+    "bruteforce": BruteForceIndex,
+    "ivf": IVFIndex,
+    "pgvector": PgVectorIndex,
+}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_vector_index(catalog):
+    # One index per catalog snapshot; None when candidate retrieval is disabled
+    global _index
+    backend = _BACKENDS.get(VECTOR_INDEX)
+    if backend is None or VECTOR_CANDIDATES <= 0:
+        return None
+
+    index = _index
+    if index is not None and index.catalog is catalog:
+        return index
+    with _index_lock:
+        if _index is None or _index.catalog is not catalog:
+            try:
+                _index = backend(catalog)
+            except Exception as e:
+                print(f"[WARN] Building {VECTOR_INDEX} index failed, using brute force: {e}", flush=True)
+                _index = BruteForceIndex(catalog)
+        return _index
+
+def retrieve_candidates(catalog, query_embedding, k: int = VECTOR_CANDIDATES):
+    # Candidate rows for a query, or None to score the whole catalog
+    if query_embedding is None:
+        return None
+    index = get_vector_index(catalog)
+    if index is None:
+        return None
+    return index.search(query_embedding, k)
@@ -0,0 +1,100 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a TTL, bounded by entry count and optionally bytes.
+
+    Entries belong to one catalog version: a lookup or store with a different
+    ``version`` drops everything first, so stale results never outlive a refresh.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 60,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = len
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.version = None
+        self._data: "OrderedDict[Hashable, tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def _check_version(self, version):
+        if version is not None and version != self.version:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._bytes = 0
+            self.version = version
+
+    def _drop(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key: Hashable, version=None, default=None):
+        with self._lock:
+            self._check_version(version)
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, version=None, ttl: Optional[float] = None):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes if self.max_bytes is not None else None,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,154 @@
+import json
+import time
+import hashlib
+from typing import List, Dict, Any, Iterable, Optional
+import numpy as np
+from .tag_index import TagIndex
+from .tag_vocabulary import TagVocabulary
+from .title_index import TitleIndex
+from .fragments import FragmentCache
+
+CATALOG_COLUMNS = """
+    id, title, all_titles, main_picture, tags, synopsis,
+    rating, is_nsfw, total_episodes, children_ids, last_updated
+"""
+
+def ensure_list(val):
+    if not val:
+        return []
+    if isinstance(val, str):
+        try:
+            return json.loads(val)
+        except Exception:
+            return [val]
+    return list(val)
+
+def ensure_dict(val):
+    if not val:
+        return None
+    if isinstance(val, str):
+        try:
+            return json.loads(val)
+        except Exception:
+            return None
+    return val
+
+def row_to_anime(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "title": row.get("title"),
+        "all_titles": ensure_list(row.get("all_titles")),
+        "main_picture": ensure_dict(row.get("main_picture")),
+        "tags": ensure_list(row.get("tags")),
+        "synopsis": row.get("synopsis"),
+        "rating": row.get("rating"),
+        "is_nsfw": bool(row.get("is_nsfw", False)),
+        "total_episodes": int(row.get("total_episodes") or 0),
+        "children_ids": ensure_list(row.get("children_ids")),
+        "last_updated": row.get("last_updated"),
+    }
+
+def parse_embedding(val, dim: int) -> Optional[np.ndarray]:
+    # float8[] comes back as a list, pgvector as its text form "[0.1,0.2,...]"
+    if val is None:
+        return None
+    if isinstance(val, str):
+        try:
+            val = json.loads(val.replace("{", "[").replace("}", "]"))
+        except Exception:
+            return None
+    vec = np.asarray(val, dtype=np.float32)
+    if vec.ndim != 1 or vec.shape[0] != dim:
+        return None
+    return vec
+
+def build_embedding_matrix(vectors: List[Optional[np.ndarray]], dim: int):
+    # Row-aligned with the catalog, L2-normalized so cosine is a plain dot product
+    matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+    has_embedding = np.zeros(len(vectors), dtype=bool)
+    for row, vec in enumerate(vectors):
+        if vec is not None:
+            matrix[row] = vec
+            has_embedding[row] = True
+    norms = np.linalg.norm(matrix, axis=1)
+    has_embedding &= norms > 0
+    matrix[has_embedding] /= norms[has_embedding, None]
+    return matrix, has_embedding
+
+def catalog_version(total_entries: int, last_updated) -> str:
+    # Row count catches inserts/deletes, max(last_updated) catches upserts
+    raw = f"{total_entries}:{last_updated.isoformat() if hasattr(last_updated, 'isoformat') else last_updated}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class CatalogSnapshot:
+    """Read-only in-memory copy of the anime table, built once and shared by every router.
+
+    Never mutate ``items`` or the dicts inside it; a refresh builds a new snapshot
+    and swaps it in as a whole. ``embeddings`` is a normalized float32 matrix whose
+    row ``i`` belongs to ``items[i]``; rows without an embedding are all zeros.
+    ``vocabulary`` interns every tag; ``tags`` and ``titles`` are the tag-incidence
+    and typeahead indexes over the same rows; ``fragments`` caches their JSON.
+
+    Passing ``has_embedding`` means ``embeddings`` is already a normalized
+    (rows x dim) matrix, e.g. a read-only memmap from the snapshot store, and
+    it is used as is instead of being copied.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[Dict[str, Any]],
+        embeddings: Optional[List[Optional[np.ndarray]]] = None,
+        dim: int = 1536,
+        has_embedding: Optional[np.ndarray] = None
+    ):
+        self.items: List[Dict[str, Any]] = list(items)
+        self.by_id: Dict[int, Dict[str, Any]] = {a["id"]: a for a in self.items}
+        self.row_of: Dict[int, int] = {a["id"]: row for row, a in enumerate(self.items)}
+        self.ids = np.array([a["id"] for a in self.items], dtype=np.int64)
+        self.is_nsfw = np.array([a["is_nsfw"] for a in self.items], dtype=bool)
+        if has_embedding is not None:
+            self.embeddings, self.has_embedding = embeddings, np.asarray(has_embedding, dtype=bool)
+        else:
+            self.embeddings, self.has_embedding = build_embedding_matrix(
+                embeddings if embeddings is not None else [None] * len(self.items), dim
+            )
+        self.vocabulary = TagVocabulary(self.items)
+        self.tags = TagIndex(self.items, self.vocabulary)
+        self.titles = TitleIndex(self.items, self.is_nsfw)
+        self.fragments = FragmentCache(self.items)
+        # Item-to-item neighbour lists and IVF clustering; only exported snapshots carry them
+        self.neighbors = None
+        self.ivf = None
+        self.total_entries = len(self.items)
+        self.last_updated = max(
+            (a.get("last_updated") for a in self.items if a.get("last_updated")),
+            default=None
+        )
+        self.version = catalog_version(self.total_entries, self.last_updated)
+        self.built_at = time.time()
+
+    # Derived state rebuilt by __init__ but not needed to restore a snapshot
+    _UNPICKLED = ("embeddings", "has_embedding", "fragments", "neighbors", "ivf", "built_at")
+
+    def state(self) -> Dict[str, Any]:
+        # Items plus every index built over them, for the snapshot store
+        return {k: v for k, v in vars(self).items() if k not in self._UNPICKLED}
+
+    @classmethod
+    def restore(cls, state: Dict[str, Any], embeddings: np.ndarray, has_embedding: np.ndarray) -> "CatalogSnapshot":
+        # Rebuild a snapshot from state() without re-deriving its indexes;
+        # ``embeddings`` is used as is (e.g. a read-only memmap)
+        snapshot = cls.__new__(cls)
+        snapshot.__dict__.update(state)
+        snapshot.embeddings, snapshot.has_embedding = embeddings, np.asarray(has_embedding, dtype=bool)
+        snapshot.fragments = FragmentCache(snapshot.items)
+        snapshot.neighbors = snapshot.ivf = None
+        snapshot.built_at = time.time()
+        return snapshot
+
+    def __len__(self):
+        return self.total_entries
+
+    def __contains__(self, anime_id):
+        return anime_id in self.by_id
@@ -1,20 +1,34 @@
 import os
-from typing import List, Dict, Any
+import time
+import asyncio
+import threading
+import numpy as np
+from typing import List, Dict, Any, Tuple
 import psycopg
 from psycopg.rows import dict_row
-from psycopg_pool import ConnectionPool
-from rapidfuzz import fuzz
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
 from dotenv import load_dotenv
+from .catalog import (
+    CatalogSnapshot, CATALOG_COLUMNS, catalog_version, row_to_anime, parse_embedding, build_embedding_matrix
+)
+from .snapshot_store import load_snapshot, write_snapshot, current_version
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 EMBED_DIM = int(os.getenv("EMBED_DIM", "1536"))
+CATALOG_CHECK_INTERVAL = int(os.getenv("CATALOG_CHECK_INTERVAL", "60"))  # seconds
+CATALOG_CHANNEL = os.getenv("CATALOG_CHANNEL", "anime_updated")  # NOTIFY channel fired by the ETL scripts
+CATALOG_LISTEN = os.getenv("CATALOG_LISTEN", "1") != "0"
 
 pool = ConnectionPool(conninfo=DATABASE_URL, kwargs={"row_factory": dict_row}, min_size=1, max_size=5)
+# Opened and closed by the app lifespan (see main.py)
+apool = AsyncConnectionPool(conninfo=DATABASE_URL, kwargs={"row_factory": dict_row}, min_size=1, max_size=5, open=False)
 
-# Cache last snapshot to avoid repeated DB hits when not needed
-_cache: List[Dict[str, Any]] | None = None
-_index_by_id: Dict[int, Dict[str, Any]] | None = None
+# Process-wide catalog snapshot, replaced as a whole on refresh
+_catalog: CatalogSnapshot | None = None
+_catalog_checked_at = 0.0
+_catalog_lock = threading.Lock()
+_export_tried: str | None = None  # version whose on-disk export was last tried for neighbours
 
 def _normalize_titles_inplace(rows: List[Dict[str, Any]]) -> None:
     for a in rows:
@@ -23,101 +37,245 @@ def _normalize_titles_inplace(rows: List[Dict[str, Any]]) -> None:
             ats = [t.strip() for t in a.get("all_titles", []) if t and t.strip()]
             a["title"] = ats[0] if ats else f"Untitled #{a.get('id','')}"
 
-import os, psycopg, json
-from psycopg.rows import dict_row
-from dotenv import load_dotenv
+def _fetch_catalog_version() -> str:
+    with pool.connection() as conn:
+        row = conn.execute(
+            "SELECT count(*) AS total_entries, max(last_updated) AS last_updated FROM anime"
+        ).fetchone()
+    return catalog_version(row["total_entries"], row["last_updated"])
 
-load_dotenv()
-DATABASE_URL = os.getenv("DATABASE_URL")
+def _fetch_catalog() -> CatalogSnapshot:
+    items, embeddings = [], []
+    with pool.connection() as conn:
+        for row in conn.execute(f"SELECT {CATALOG_COLUMNS}, embedding FROM anime"):
+            items.append(row_to_anime(row))
+            embeddings.append(parse_embedding(row.get("embedding"), EMBED_DIM))
+    return CatalogSnapshot(items, embeddings, dim=EMBED_DIM)
+
+def _writable_embeddings(matrix: np.ndarray) -> np.ndarray:
+    # A copy-on-write remap of an exported matrix only copies the pages of
+    # rows that get patched; the rest stays shared with the other workers
+    filename = getattr(matrix, "filename", None)
+    if isinstance(matrix, np.memmap) and filename:
+        try:
+            return np.load(filename, mmap_mode="c")
+        except (OSError, ValueError):
+            pass
+    return np.array(matrix, dtype=np.float32)
+
+def _fetch_catalog_delta(current: CatalogSnapshot, version: str) -> CatalogSnapshot | None:
+    # Merge rows touched since the current watermark into a new snapshot; the
+    # current one keeps serving until the swap. None means "do a full load".
+    watermark = current.last_updated
+    if watermark is None:
+        return None
+    changed, vectors = [], []
+    with pool.connection() as conn:
+        # >= so rows sharing the watermark timestamp are never missed
+        for row in conn.execute(
+            f"SELECT {CATALOG_COLUMNS}, embedding FROM anime WHERE last_updated >= %s", (watermark,)
+        ):
+            changed.append(row_to_anime(row))
+            vectors.append(parse_embedding(row.get("embedding"), EMBED_DIM))
+
+    items = list(current.items)
+    embeddings = _writable_embeddings(current.embeddings)
+    has_embedding = np.array(current.has_embedding, dtype=bool)
+    new_matrix, new_has = build_embedding_matrix(vectors, EMBED_DIM)
+    appended = []
+    for anime, vec, has in zip(changed, new_matrix, new_has):
+        row = current.row_of.get(anime["id"])
+        if row is None:
+            appended.append((anime, vec, has))
+            continue
+        items[row] = anime
+        embeddings[row] = vec
+        has_embedding[row] = has
+    if appended:
+        items.extend(a for a, _, _ in appended)
+        embeddings = np.vstack([embeddings, np.stack([v for _, v, _ in appended])])
+        has_embedding = np.concatenate([has_embedding, np.array([h for _, _, h in appended], dtype=bool)])
+
+    snapshot = CatalogSnapshot(items, embeddings, dim=EMBED_DIM, has_embedding=has_embedding)
+    # Deletes (or rows without last_updated) leave the versions apart
+    if snapshot.version != version:
+        return None
+    print(f"[INFO] Catalog snapshot {snapshot.version} patched with {len(changed)} changed rows", flush=True)
+    return snapshot
+
+def _load_catalog(version: str | None, current: CatalogSnapshot | None = None) -> CatalogSnapshot:
+    # The exported on-disk snapshot when it matches the table, then the rows
+    # changed since the current snapshot, else a full DB load
+    snapshot = load_snapshot(expected_version=version, dim=EMBED_DIM) if version else None
+    if snapshot is not None:
+        print(f"[INFO] Catalog snapshot {snapshot.version} mapped from disk ({len(snapshot)} entries)", flush=True)
+        return snapshot
+    if version and current is not None:
+        snapshot = _fetch_catalog_delta(current, version)
+        if snapshot is not None:
+            return snapshot
+    snapshot = _fetch_catalog()
+    print(f"[INFO] Catalog snapshot {snapshot.version} loaded ({len(snapshot)} entries)", flush=True)
+    return snapshot
+
+def refresh_catalog(force: bool = False) -> CatalogSnapshot:
+    # Rebuild only when the table's version moved; concurrent callers wait for one rebuild
+    global _catalog, _catalog_checked_at, _export_tried
+    with _catalog_lock:
+        current = _catalog
+        if force:
+            version = None
+        else:
+            if current is not None and time.monotonic() - _catalog_checked_at <= CATALOG_CHECK_INTERVAL:
+                return current
+            try:
+                version = _fetch_catalog_version()
+            except psycopg.Error as e:
+                if current is None:
+                    # Cold start without a DB: serve the last export, unverified
+                    current = load_snapshot(dim=EMBED_DIM)
+                    if current is None:
+                        raise
+                    _catalog = current
+                # Keep serving the last good snapshot while the DB is unreachable
+                print(f"[WARN] Catalog version check failed: {e}", flush=True)
+                _catalog_checked_at = time.monotonic()
+                return current
+            if current is not None and version == current.version:
+                _catalog_checked_at = time.monotonic()
+                if current.neighbors is None and _export_tried != version and current_version() == version:
+                    # A poll patched in the rows before the ETL export landed;
+                    # take the export for its neighbour lists (once per version)
+                    _export_tried = version
+                    exported = load_snapshot(expected_version=version, dim=EMBED_DIM)
+                    if exported is not None:
+                        print(f"[INFO] Catalog snapshot {version} mapped from disk with neighbours", flush=True)
+                        _catalog = current = exported
+                return current
+
+        snapshot = _load_catalog(version, current)
+        _catalog = snapshot
+        _catalog_checked_at = time.monotonic()
+        return snapshot
+
+def invalidate_catalog():
+    # Make the next get_catalog() re-check the table version right away
+    global _catalog_checked_at
+    _catalog_checked_at = float("-inf")
+
+def notify_catalog_changed(conn=None):
+    # Wake every API worker listening on CATALOG_CHANNEL (see start_catalog_listener)
+    if conn is not None:
+        conn.execute(f"NOTIFY {CATALOG_CHANNEL}")
+        conn.commit()  # delivered on commit
+        return
+    with pool.connection() as conn:
+        conn.execute(f"NOTIFY {CATALOG_CHANNEL}")
 
-def load_anime_data():
-    with psycopg.connect(DATABASE_URL, row_factory=dict_row) as conn:
-        rows = conn.execute("""
-            SELECT id, title, all_titles, main_picture, tags, synopsis,
-                   rating, is_nsfw, total_episodes, children_ids, last_updated
-            FROM anime
-        """).fetchall()
-
-    data = []
-    for row in rows:
-        def ensure_list(val):
-            if not val:
-                return []
-            if isinstance(val, str):
-                try:
-                    return json.loads(val)
-                except Exception:
-                    return [val]
-            return list(val)
-
-        def ensure_dict(val):
-            if not val:
-                return None
-            if isinstance(val, str):
-                try:
-                    return json.loads(val)
-                except Exception:
-                    return None
-            return val
-
-        data.append({
-            "id": row["id"],
-            "title": row.get("title"),
-            "all_titles": ensure_list(row.get("all_titles")),
-            "main_picture": ensure_dict(row.get("main_picture")),
-            "tags": ensure_list(row.get("tags")),
-            "synopsis": row.get("synopsis"),
-            "rating": row.get("rating"),
-            "is_nsfw": bool(row.get("is_nsfw", False)),
-            "total_episodes": int(row.get("total_episodes") or 0),
-            "children_ids": ensure_list(row.get("children_ids")),
-            "last_updated": row.get("last_updated"),
-        })
-    return data
-
-def get_by_ids(ids: List[int]) -> List[Dict[str, Any]]:
+def _listen_catalog(stop: threading.Event):
+    backoff = 1
+    while not stop.is_set():
+        try:
+            with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+                conn.execute(f"LISTEN {CATALOG_CHANNEL}")
+                backoff = 1
+                while not stop.is_set():
+                    # Short timeout so shutdown is noticed; a burst costs one reload plus cheap version checks
+                    if any(True for _ in conn.notifies(timeout=1.0)):
+                        invalidate_catalog()
+                        try:
+                            refresh_catalog()
+                        except Exception as e:
+                            # Keep listening; the next NOTIFY or poll retries
+                            print(f"[WARN] Catalog refresh after NOTIFY failed: {e!r}", flush=True)
+        except psycopg.Error as e:
+            print(f"[WARN] Catalog listener disconnected: {e}", flush=True)
+            stop.wait(backoff)
+            backoff = min(backoff * 2, 60)
+        except Exception as e:
+            # Never let the thread die silently and leave only interval polling
+            print(f"[WARN] Catalog listener failed: {e!r}", flush=True)
+            stop.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+def start_catalog_listener() -> threading.Event | None:
+    # Background LISTEN so ETL upserts show up immediately instead of after
+    # CATALOG_CHECK_INTERVAL; set the returned event to stop it
+    if not CATALOG_LISTEN or not DATABASE_URL:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_listen_catalog, args=(stop,), name="catalog-listener", daemon=True).start()
+    return stop
+
+def export_catalog_snapshot():
+    # Called at the end of the ETL scripts so API workers can map the new data
+    from ..recommender.neighbors import build_neighbors
+    from ..recommender.vector_index import build_ivf
+
+    snapshot = _fetch_catalog()
+    snapshot.neighbors = build_neighbors(snapshot)
+    # Clustered once here, so workers using VECTOR_INDEX=ivf never train on a request
+    snapshot.ivf = build_ivf(snapshot)
+    path = write_snapshot(snapshot)
+    print(f"[INFO] Catalog snapshot {snapshot.version} exported to {path} ({len(snapshot)} entries)", flush=True)
+    return path
+
+def get_catalog() -> CatalogSnapshot:
+    snapshot = _catalog
+    if snapshot is None or time.monotonic() - _catalog_checked_at > CATALOG_CHECK_INTERVAL:
+        return refresh_catalog()
+    return snapshot
+
+def peek_catalog() -> CatalogSnapshot | None:
+    # Current snapshot, if any, without loading or version-checking
+    return _catalog
+
+async def aget_catalog() -> CatalogSnapshot:
+    # Same as get_catalog, but a load or version check runs off the event loop
+    snapshot = _catalog
+    if snapshot is None or time.monotonic() - _catalog_checked_at > CATALOG_CHECK_INTERVAL:
+        return await asyncio.to_thread(refresh_catalog)
+    return snapshot
+
+_RECORDS_SQL = f"SELECT {CATALOG_COLUMNS} FROM anime WHERE id = ANY(%s)"
+
+def _in_order(by_id: Dict[int, Dict[str, Any]], ids: List[int]) -> List[Dict[str, Any]]:
+    return [by_id[i] for i in dict.fromkeys(ids) if i in by_id]
+
+async def aget_anime_records(ids: List[int]) -> List[Dict[str, Any]]:
+    # Anime in the requested order (unknown ids skipped): from the snapshot when
+    # one is warm, otherwise a primary-key lookup instead of a full table load
     if not ids:
         return []
-    with pool.connection() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT id, title, all_titles, main_picture, tags, synopsis, rating,
-                   is_nsfw, total_episodes
-            FROM anime WHERE id = ANY(%s)
-        """, (ids,))
-        rows = cur.fetchall()
-        return rows
+    if _catalog is not None:
+        return _in_order((await aget_catalog()).by_id, ids)
+    async with apool.connection() as conn:
+        cur = await conn.execute(_RECORDS_SQL, (list(ids),))
+        rows = await cur.fetchall()
+    return _in_order({row["id"]: row_to_anime(row) for row in rows}, ids)
+
+def resolve_titles(titles: List[str], threshold: int = 80) -> Dict[str, List[Tuple[int, float]]]:
+    # Exact hash hits plus trigram-blocked fuzzy matches, as (anime id, score) per title
+    catalog = get_catalog()
+    resolved = {}
+    for title in titles:
+        if not title or not isinstance(title, str) or title in resolved:
+            continue
+        resolved[title] = [
+            (catalog.items[row]["id"], score)
+            for row, score in catalog.titles.resolve(title, threshold)
+        ]
+    return resolved
 
 def get_by_titles(titles: List[str], threshold: int = 80) -> List[int]:
-    # Fuzzy-match titles in DB.
+    # Fuzzy-match titles against the in-memory snapshot.
     # Exact match first, then fuzzy.
     if not titles:
         return []
 
-    # Use in-memory cache for fuzziness
-    data = load_anime_data()
-    matched_ids = []
-
-    for title_to_match in titles:
-        if not title_to_match or not isinstance(title_to_match, str):
-            continue
-        t_norm = title_to_match.strip().lower()
-
-        for anime in data:
-            all_titles = []
-            if anime.get("title"):
-                all_titles.append(anime["title"])
-            all_titles.extend(anime.get("all_titles", []))
-            all_titles_lower = [alt.strip().lower() for alt in all_titles if alt]
-
-            # exact match
-            if t_norm in all_titles_lower:
-                matched_ids.append(anime["id"])
-                continue
-
-            # fuzzy match
-            for alt in all_titles_lower:
-                if fuzz.ratio(t_norm, alt) >= threshold:
-                    matched_ids.append(anime["id"])
-                    break
-
-    return list(set(matched_ids))
+    matched_ids = {
+        anime_id
+        for matches in resolve_titles(titles, threshold).values()
+        for anime_id, _ in matches
+    }
+    return list(matched_ids)
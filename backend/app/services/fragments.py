@@ -0,0 +1,47 @@
+from typing import List, Dict, Any, Optional
+import orjson
+from ..models.schemas import Anime
+
+def _search_projection(anime: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": anime["id"],
+        "title": anime.get("title"),
+        "all_titles": anime.get("all_titles", []),
+        "main_picture": anime.get("main_picture"),
+        "tags": anime.get("tags", []),
+        "synopsis": anime.get("synopsis"),
+        "total_episodes": anime.get("total_episodes"),
+        "is_nsfw": anime.get("is_nsfw", False),
+    }
+
+
+class FragmentCache:
+    """Per-snapshot cache of each anime's public JSON, serialized on first use.
+
+    ``anime(row)`` is exactly what ``response_model`` would emit for the
+    ``Anime`` schema and ``search(row)`` is the /api/search projection, so
+    endpoints can join cached bytes instead of re-validating and re-encoding
+    the same rows on every request. Lives and dies with its CatalogSnapshot.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = items
+        self._anime: List[Optional[bytes]] = [None] * len(items)
+        self._search: List[Optional[bytes]] = [None] * len(items)
+
+    def anime(self, row: int) -> bytes:
+        frag = self._anime[row]
+        if frag is None:
+            frag = orjson.dumps(Anime.model_validate(self.items[row]).model_dump(mode="json"))
+            self._anime[row] = frag  # a racing thread just computes the same bytes
+        return frag
+
+    def search(self, row: int) -> bytes:
+        frag = self._search[row]
+        if frag is None:
+            frag = orjson.dumps(_search_projection(self.items[row]))
+            self._search[row] = frag
+        return frag
+
+def join_array(fragments) -> bytes:
+    return b"[" + b",".join(fragments) + b"]"
@@ -0,0 +1,114 @@
+import os
+import gzip
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Callable, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+import orjson
+import brotli
+from dotenv import load_dotenv
+from .cache import LRUCache
+load_dotenv()
+
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))  # seconds, Cache-Control max-age
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Encoded bodies per (key, encoding), dropped whenever the catalog version changes
+_bodies = LRUCache(max_entries=4096, ttl=24 * 3600, max_bytes=HTTP_CACHE_MAX_BYTES)
+
+def _http_date(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def _pick_encoding(request: Request) -> str:
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in request.headers.get("accept-encoding", "").split(",")
+    }
+    if "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return "identity"
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return "*" in tags or etag in tags
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[str]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _encode(payload: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(payload, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(payload, compresslevel=6, mtime=0)
+    return payload
+
+def dump_json(obj: Any) -> bytes:
+    # Pre-serialized bodies (see fragments.py) pass through untouched
+    if isinstance(obj, bytes):
+        return obj
+    return orjson.dumps(obj, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+
+def cached_response(request: Request, catalog, build: Callable[[], Any], key: str) -> Response:
+    """JSON response for catalog-derived data with validators and compression.
+
+    ``build`` only runs on a miss and returns data or ready JSON bytes. The strong ETag is derived from the catalog
+    version and ``key``, so it changes exactly when the underlying data can.
+    Without a warm catalog the body is sent as plain, uncached JSON.
+    """
+    if catalog is None:
+        return Response(dump_json(build()), media_type="application/json")
+
+    etag = '"' + hashlib.sha1(f"{catalog.version}:{key}".encode("utf-8")).hexdigest()[:24] + '"'
+    last_modified = _http_date(catalog.last_updated)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={HTTP_CACHE_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    encoding = _pick_encoding(request)
+    body = _bodies.get((key, encoding), version=catalog.version)
+    if body is None:
+        payload = _bodies.get((key, "identity"), version=catalog.version)
+        if payload is None:
+            payload = dump_json(build())
+            _bodies.set((key, "identity"), payload, version=catalog.version)
+        if len(payload) < COMPRESS_MIN_BYTES:
+            encoding, body = "identity", payload
+        else:
+            body = _encode(payload, encoding)
+            _bodies.set((key, encoding), body, version=catalog.version)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
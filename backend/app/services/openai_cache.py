@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Optional
+import numpy as np
+from dotenv import load_dotenv
+from .cache import LRUCache
+load_dotenv()
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+OPENAI_CACHE_PATH = Path(os.getenv("OPENAI_CACHE_PATH", DATA_DIR / "openai_cache.sqlite3"))
+OPENAI_CACHE_TTL = int(os.getenv("OPENAI_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+OPENAI_CACHE_MEMORY_SIZE = int(os.getenv("OPENAI_CACHE_MEMORY_SIZE", "2048"))  # entries
+OPENAI_CACHE_PRUNE_INTERVAL = int(os.getenv("OPENAI_CACHE_PRUNE_INTERVAL", "3600"))  # seconds between expired-row deletes
+
+def normalize_query(text: str) -> str:
+    return " ".join((text or "").split()).lower()
+
+
+class OpenAICache:
+    """Two-tier cache for OpenAI results: an in-process LRU over a SQLite file.
+
+    Keys are content hashes, so every uvicorn worker (and every restart) that
+    opens the same file shares the same entries. Expired rows are deleted when
+    a connection opens and then at most every ``OPENAI_CACHE_PRUNE_INTERVAL``
+    seconds on write, so the file does not grow forever. SQLite errors only
+    cost a miss.
+    """
+
+    def __init__(self, path: Path = OPENAI_CACHE_PATH, memory_size: int = OPENAI_CACHE_MEMORY_SIZE, ttl: int = OPENAI_CACHE_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries=memory_size, ttl=ttl)
+        self._local = threading.local()
+        self._pruned_at = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS openai_cache (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS openai_cache_created_at ON openai_cache (created_at)")
+            self._local.conn = conn
+            self._prune(conn)
+        return conn
+
+    def _prune(self, conn: sqlite3.Connection):
+        self._pruned_at = time.monotonic()
+        try:
+            deleted = conn.execute(
+                "DELETE FROM openai_cache WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+        except sqlite3.Error as e:
+            print(f"[WARN] OpenAI cache prune failed: {e}", flush=True)
+            return
+        if deleted:
+            print(f"[INFO] OpenAI cache pruned {deleted} expired entries", flush=True)
+
+    @staticmethod
+    def key(kind: str, model: str, text: str, **extra) -> str:
+        raw = json.dumps({"kind": kind, "model": model, "text": normalize_query(text), **extra}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        try:
+            row = self._conn().execute(
+                "SELECT value FROM openai_cache WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[WARN] OpenAI cache read failed: {e}", flush=True)
+            return None
+        if row is None:
+            return None
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def _set(self, key: str, kind: str, value: bytes):
+        self.memory.set(key, value)
+        self._store(key, kind, value)
+
+    def _store(self, key: str, kind: str, value: bytes):
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO openai_cache (key, kind, value, created_at) VALUES (?, ?, ?, ?)",
+                (key, kind, value, time.time())
+            )
+        except sqlite3.Error as e:
+            print(f"[WARN] OpenAI cache write failed: {e}", flush=True)
+            return
+        if time.monotonic() - self._pruned_at > OPENAI_CACHE_PRUNE_INTERVAL:
+            self._prune(conn)
+
+    def get_json(self, key: str) -> Optional[Any]:
+        value = self._get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key: str, kind: str, value: Any):
+        self._set(key, kind, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def get_embedding(self, key: str) -> Optional[np.ndarray]:
+        value = self._get(key)
+        return np.frombuffer(value, dtype=np.float32) if value is not None else None
+
+    def set_embedding(self, key: str, vec: np.ndarray):
+        self._set(key, "embedding", np.asarray(vec, dtype=np.float32).tobytes())
+
+    # Async variants for request handlers: memory hits return inline, SQLite
+    # reads and writes run in a worker thread so they never block the loop
+    async def _aget(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self._get, key)
+
+    async def _aset(self, key: str, kind: str, value: bytes):
+        self.memory.set(key, value)
+        await asyncio.to_thread(self._store, key, kind, value)
+
+    async def aget_json(self, key: str) -> Optional[Any]:
+        value = await self._aget(key)
+        return json.loads(value) if value is not None else None
+
+    async def aset_json(self, key: str, kind: str, value: Any):
+        await self._aset(key, kind, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    async def aget_embedding(self, key: str) -> Optional[np.ndarray]:
+        value = await self._aget(key)
+        return np.frombuffer(value, dtype=np.float32) if value is not None else None
+
+    async def aset_embedding(self, key: str, vec: np.ndarray):
+        await self._aset(key, "embedding", np.asarray(vec, dtype=np.float32).tobytes())
+
+
+openai_cache = OpenAICache()
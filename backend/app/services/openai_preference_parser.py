@@ -1,30 +1,25 @@
 import os
 import json
 from dotenv import load_dotenv
-from openai import OpenAI
-from .db_loader import load_anime_data
+from openai import AsyncOpenAI
+from .db_loader import aget_catalog
+from .openai_cache import openai_cache
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+PARSE_MODEL = "gpt-4o-mini"
 
-# Load tags dynamically from anime_data.json
-def load_known_tags(nsfw_ok=False):
-    data = load_anime_data()
-    tags_map = {}
-    NSFW_TAGS = {"hentai", "ecchi", "magical sex shift", "erotica"}
-    for anime in data:
-        for tag in anime.get("tags", []):
-            tag_clean = tag.strip()
-            tag_lower = tag_clean.lower()
-            if not nsfw_ok and tag_lower in NSFW_TAGS:
-                continue
-            if tag_lower not in tags_map:
-                tags_map[tag_lower] = tag_clean
-    return sorted(tags_map.values(), key=lambda t: t.lower())
+async def parse_preferences(user_query: str, nsfw_ok=False):
+    vocabulary = (await aget_catalog()).vocabulary
+    known_tags = vocabulary.tags(nsfw_ok)
+
+    # Identical queries against the same tag vocabulary skip the API entirely;
+    # nsfw_ok picks the tag list, as NSFW_TAGS is fixed
+    cache_key = openai_cache.key("parse", PARSE_MODEL, user_query, nsfw_ok=bool(nsfw_ok), vocab=vocabulary.version)
+    cached = await openai_cache.aget_json(cache_key)
+    if cached is not None:
+        return cached
 
-def parse_preferences(user_query: str, nsfw_ok=False):
-    known_tags = load_known_tags(nsfw_ok)
-    
     system_prompt = f"""
     You are an anime preference translator. You understand any language.
     Map the user's description into:
@@ -39,8 +34,8 @@ def parse_preferences(user_query: str, nsfw_ok=False):
     - Only output valid JSON, no explanations or extra text.
     """
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    resp = await client.chat.completions.create(
+        model=PARSE_MODEL,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_query}
@@ -56,6 +51,7 @@ def parse_preferences(user_query: str, nsfw_ok=False):
         if not parsed.get("semantic_moods"):
             parsed["semantic_moods"] = [user_query]
 
+        await openai_cache.aset_json(cache_key, "parse", parsed)
         return parsed
     except json.JSONDecodeError:
         return {
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from dotenv import load_dotenv
+from .catalog import CatalogSnapshot
+from ..recommender.neighbors import NeighborLists
+from ..recommender.vector_index import IVFLists
+load_dotenv()
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", DATA_DIR / "catalog_snapshot"))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))  # versions kept on disk
+FORMAT = 2
+
+# On-disk layout, one immutable directory per export:
+#   SNAPSHOT_DIR/CURRENT               name of the live export directory
+#   SNAPSHOT_DIR/v_<version>.<export>/
+#       manifest.json                  format, version, rows, dim, last_updated
+#       embeddings.npy                 float32 (rows x dim), L2-normalized
+#       has_embedding.npy              bool (rows,)
+#       state.pickle                   items plus their tag/title indexes (CatalogSnapshot.state)
+#       neighbors.npy, neighbor_scores.npy  optional (rows x K) item-to-item lists
+#       ivf_centroids.npy, ivf_assignment.npy  optional IVF clustering (nlist x dim, rows)
+# Every export gets a fresh directory, so a re-export of the same version
+# replaces stale contents instead of trusting the version string. The arrays
+# are opened with mmap_mode="r", so every worker on the host shares the same
+# page-cache pages instead of holding its own copy of the embeddings, and the
+# pickled state restores the indexes without re-parsing every record.
+
+def _version_of(name: str) -> Optional[str]:
+    return name.removeprefix("v_").split(".", 1)[0] or None
+
+def _prune(keep: str):
+    versions = sorted(
+        (p for p in SNAPSHOT_DIR.glob("v_*") if p.is_dir() and p.name != keep),
+        key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    # Workers that still map an old version keep their pages after the unlink
+    for old in versions[max(0, SNAPSHOT_KEEP - 1):]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def write_snapshot(snapshot: CatalogSnapshot) -> Path:
+    """Write ``snapshot`` to a new directory in SNAPSHOT_DIR and point CURRENT at it.
+
+    Files go to a temp directory that is renamed into place, and CURRENT is
+    swapped with os.replace, so readers never see a half-written export.
+    """
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=".tmp_", dir=SNAPSHOT_DIR))
+    # Unique per export: time plus the temp dir's random suffix
+    name = f"v_{snapshot.version}.{time.time_ns():x}{tmp.name.removeprefix('.tmp_')}"
+    target = SNAPSHOT_DIR / name
+    try:
+        with open(tmp / "state.pickle", "wb") as f:
+            pickle.dump(snapshot.state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        np.save(tmp / "has_embedding.npy", snapshot.has_embedding)
+        np.save(tmp / "embeddings.npy", np.ascontiguousarray(snapshot.embeddings, dtype=np.float32))
+        if snapshot.neighbors is not None:
+            np.save(tmp / "neighbors.npy", snapshot.neighbors.rows)
+            np.save(tmp / "neighbor_scores.npy", snapshot.neighbors.scores)
+        if snapshot.ivf is not None:
+            np.save(tmp / "ivf_centroids.npy", snapshot.ivf.centroids)
+            np.save(tmp / "ivf_assignment.npy", snapshot.ivf.assignment)
+        manifest = {
+            "format": FORMAT,
+            "version": snapshot.version,
+            "rows": len(snapshot),
+            "dim": int(snapshot.embeddings.shape[1]),
+            "last_updated": snapshot.last_updated.isoformat() if snapshot.last_updated else None,
+            "neighbors": snapshot.neighbors.rows.shape[1] if snapshot.neighbors is not None else None,
+            "ivf_nlist": len(snapshot.ivf.centroids) if snapshot.ivf is not None else None,
+        }
+        # Manifest last: a directory without one is never loaded
+        (tmp / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.chmod(tmp, 0o755)
+        os.rename(tmp, target)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    pointer = SNAPSHOT_DIR / f".CURRENT.{os.getpid()}"
+    pointer.write_text(name, encoding="utf-8")
+    os.replace(pointer, SNAPSHOT_DIR / "CURRENT")
+    _prune(keep=name)
+    return target
+
+def _current_name() -> Optional[str]:
+    try:
+        return (SNAPSHOT_DIR / "CURRENT").read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+def current_version() -> Optional[str]:
+    name = _current_name()
+    return _version_of(name) if name else None
+
+def load_snapshot(expected_version: Optional[str] = None, dim: Optional[int] = None) -> Optional[CatalogSnapshot]:
+    """Open the CURRENT on-disk snapshot, or None if missing, stale or unreadable.
+
+    ``expected_version`` (usually the live table version) rejects a snapshot
+    the database has moved past; ``dim`` rejects one with other embeddings.
+    """
+    name = _current_name()
+    version = _version_of(name) if name else None
+    if version is None or (expected_version is not None and version != expected_version):
+        return None
+    path = SNAPSHOT_DIR / name
+    try:
+        manifest = json.loads((path / "manifest.json").read_text(encoding="utf-8"))
+        if manifest.get("format") != FORMAT or (dim is not None and manifest["dim"] != dim):
+            return None
+        embeddings = np.load(path / "embeddings.npy", mmap_mode="r")
+        has_embedding = np.load(path / "has_embedding.npy")
+        neighbors = None
+        if manifest.get("neighbors") is not None:
+            neighbors = NeighborLists(
+                np.load(path / "neighbors.npy", mmap_mode="r"),
+                np.load(path / "neighbor_scores.npy", mmap_mode="r")
+            )
+        ivf = None
+        if manifest.get("ivf_nlist") is not None:
+            ivf = IVFLists(np.load(path / "ivf_centroids.npy"), np.load(path / "ivf_assignment.npy", mmap_mode="r"))
+        with open(path / "state.pickle", "rb") as f:
+            state = pickle.load(f)
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError, EOFError) as e:
+        print(f"[WARN] Catalog snapshot {name} unreadable: {e}", flush=True)
+        return None
+
+    snapshot = CatalogSnapshot.restore(state, embeddings, has_embedding)
+    if (len(snapshot) != embeddings.shape[0] or len(snapshot) != manifest["rows"]
+            or snapshot.version != version or manifest["version"] != version):
+        print(f"[WARN] Catalog snapshot {name} is inconsistent, ignoring it", flush=True)
+        return None
+    snapshot.neighbors, snapshot.ivf = neighbors, ivf
+    return snapshot
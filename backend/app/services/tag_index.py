@@ -0,0 +1,52 @@
+from typing import List, Dict, Any, Iterable
+import numpy as np
+from .tag_vocabulary import TagVocabulary
+
+class TagIndex:
+    """CSR incidence matrix of catalog rows over the snapshot's tag vocabulary ids.
+
+    Row ``r`` owns the tag ids ``indices[indptr[r]:indptr[r + 1]]`` (no duplicates),
+    so per-row sums of a tag weight vector replace the per-anime set intersections.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], vocabulary: TagVocabulary):
+        self.vocabulary = vocabulary
+        self.names: List[str] = vocabulary.keys
+
+        indptr = [0]
+        indices: List[int] = []
+        for anime in items:
+            row_ids = {vocabulary.id_of(t) for t in anime.get("tags") or []} - {None}
+            indices.extend(sorted(row_ids))
+            indptr.append(len(indices))
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int32)
+        self.counts = np.diff(self.indptr)
+        self.n_rows = len(items)
+        self.n_tags = len(self.names)
+
+    def lookup(self, tags: Iterable[str]) -> np.ndarray:
+        return self.vocabulary.lookup(tags)
+
+    def row_tags(self, row: int) -> np.ndarray:
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def union(self, rows: Iterable[int]) -> np.ndarray:
+        parts = [self.row_tags(r) for r in rows]
+        if not parts:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(parts))
+
+    def dot(self, weights: np.ndarray) -> np.ndarray:
+        # Sparse (rows x tags) @ weights; weights is (tags,) or (tags, k)
+        out = np.zeros((self.n_rows,) + weights.shape[1:], dtype=np.float64)
+        nonempty = self.counts > 0
+        if nonempty.any():
+            out[nonempty] = np.add.reduceat(weights[self.indices], self.indptr[:-1][nonempty], axis=0)
+        return out
+
+    def overlap(self, row: int, mask: np.ndarray) -> List[str]:
+        # Names of this row's tags selected by a boolean (tags,) mask, sorted
+        ids = self.row_tags(row)
+        return sorted(self.names[i] for i in ids[mask[ids]])
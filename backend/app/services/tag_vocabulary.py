@@ -0,0 +1,79 @@
+import hashlib
+from typing import List, Dict, Any, Iterable, Optional
+import numpy as np
+
+# Only explicit sexual themes here
+NSFW_TAGS = frozenset({
+    "hentai",
+    "ecchi",
+    "magical sex shift",
+    "erotica"
+})
+
+def tag_key(tag: str) -> str:
+    return tag.strip().lower()
+
+
+class TagVocabulary:
+    """Every distinct tag in a catalog snapshot, interned to a dense integer id.
+
+    Ids are keyed on the stripped, lowercased tag. ``names`` keeps the first
+    casing seen, ``counts`` how many anime carry the tag, and the sorted SFW
+    and full tag lists are precomputed for /api/tags, /api/config and the
+    preference parser.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.ids: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.names: List[str] = []
+        counts: List[int] = []
+
+        for anime in items:
+            seen = set()
+            for tag in anime.get("tags") or []:
+                key = tag_key(tag)
+                if not key:
+                    continue
+                tid = self.ids.get(key)
+                if tid is None:
+                    tid = self.ids[key] = len(self.keys)
+                    self.keys.append(key)
+                    self.names.append(tag.strip())
+                    counts.append(0)
+                if tid not in seen:
+                    seen.add(tid)
+                    counts[tid] += 1
+
+        self.counts = np.array(counts, dtype=np.int64)
+        self.is_nsfw = np.array([k in NSFW_TAGS for k in self.keys], dtype=bool)
+
+        order = sorted(range(len(self.keys)), key=lambda i: self.keys[i])
+        self._sorted = {
+            True: [self.names[i] for i in order],
+            False: [self.names[i] for i in order if not self.is_nsfw[i]],
+        }
+        self._sorted_counts = {
+            True: [int(self.counts[i]) for i in order],
+            False: [int(self.counts[i]) for i in order if not self.is_nsfw[i]],
+        }
+        self.version = hashlib.sha1("\n".join(self._sorted[True]).encode("utf-8")).hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def id_of(self, tag: str) -> Optional[int]:
+        return self.ids.get(tag_key(tag)) if tag else None
+
+    def lookup(self, tags: Iterable[str]) -> np.ndarray:
+        # Unknown tags are dropped; the result is unique and sorted
+        ids = {self.id_of(t) for t in tags} - {None}
+        return np.array(sorted(ids), dtype=np.int32)
+
+    def tags(self, nsfw_ok: bool) -> List[str]:
+        # Canonical names sorted case-insensitively; shared, do not mutate
+        return self._sorted[bool(nsfw_ok)]
+
+    def tag_counts(self, nsfw_ok: bool) -> List[int]:
+        # Frequencies aligned with tags(nsfw_ok)
+        return self._sorted_counts[bool(nsfw_ok)]
@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from typing import List, Dict, Any, Tuple
+import numpy as np
+from rapidfuzz import fuzz, process
+
+NGRAM = 3
+MAX_FUZZY_ROWS = 2000  # blocking cap: rows sharing the most trigrams with the query
+_SEP = "\x00"
+
+def _grams(text: str) -> set:
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+class TitleIndex:
+    """Lowercased ``title`` + ``all_titles`` per catalog row, indexed for typeahead.
+
+    Prefix hits come from a sorted (title, row) list searched with bisect, kept
+    separately for the SFW-only and full catalog, and are returned in catalog
+    row order like a scan of the catalog would. Substring hits come from a
+    character trigram inverted index and are verified against the real titles.
+    The same trigram postings block candidates for fuzzy title resolution.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], is_nsfw: np.ndarray):
+        self.is_nsfw = is_nsfw
+        self.joined: List[str] = []
+
+        # Resolution view: stripped + lowercased titles, contiguous per row
+        self.names: List[str] = []
+        self.name_rows: List[int] = []
+        self.name_offsets = [0]
+        self.exact: Dict[str, List[int]] = {}
+
+        pairs = []
+        postings: Dict[str, List[int]] = {}
+        for row, anime in enumerate(items):
+            titles = [anime.get("title") or ""] + list(anime.get("all_titles") or [])
+            titles = list(dict.fromkeys(t.lower() for t in titles if t))
+            self.joined.append(_SEP.join(titles))
+
+            for name in dict.fromkeys(t.strip() for t in titles):
+                if not name:
+                    continue
+                self.names.append(name)
+                self.name_rows.append(row)
+                rows_for_name = self.exact.setdefault(name, [])
+                if not rows_for_name or rows_for_name[-1] != row:
+                    rows_for_name.append(row)
+            self.name_offsets.append(len(self.names))
+            pairs.extend((t, row) for t in titles)
+            for gram in set().union(*map(_grams, titles)) if titles else ():
+                postings.setdefault(gram, []).append(row)
+
+        pairs.sort()
+        sfw_pairs = [(t, r) for t, r in pairs if not is_nsfw[r]]
+        self._prefix = {
+            True: ([t for t, _ in pairs], np.array([r for _, r in pairs], dtype=np.int32)),
+            False: ([t for t, _ in sfw_pairs], np.array([r for _, r in sfw_pairs], dtype=np.int32)),
+        }
+        self.postings = {g: np.array(rows, dtype=np.int32) for g, rows in postings.items()}
+        self.name_offsets = np.array(self.name_offsets, dtype=np.int64)
+
+    def prefix(self, q: str, nsfw_ok: bool, limit: int) -> List[int]:
+        # Every title starting with q sits in one bisected range; its rows are
+        # deduplicated and the first `limit` in catalog order kept
+        keys, rows = self._prefix[nsfw_ok]
+        lo = bisect_left(keys, q)
+        hi = bisect_left(keys, q + "\U0010ffff", lo)
+        return np.unique(rows[lo:hi])[:limit].tolist()
+
+    def substring(self, q: str, nsfw_ok: bool, limit: int, skip=()) -> List[int]:
+        if len(q) >= NGRAM:
+            lists = []
+            for gram in _grams(q):
+                posting = self.postings.get(gram)
+                if posting is None:
+                    return []
+                lists.append(posting)
+            lists.sort(key=len)
+            candidates = lists[0]
+            for posting in lists[1:]:
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+            candidates = candidates.tolist()
+        else:
+            candidates = range(len(self.joined))
+
+        out = []
+        for row in candidates:
+            if len(out) >= limit:
+                break
+            if row in skip or (not nsfw_ok and self.is_nsfw[row]):
+                continue
+            if q in self.joined[row]:
+                out.append(row)
+        return out
+
+    def search(self, q: str, nsfw_ok: bool, limit: int) -> List[int]:
+        # Prefix matches first, then fill up with substring matches
+        if not q or limit <= 0:
+            return []
+        rows = self.prefix(q, nsfw_ok, limit)
+        if len(rows) < limit:
+            rows += self.substring(q, nsfw_ok, limit - len(rows), skip=set(rows))
+        return rows
+
+    def _fuzzy_pool(self, q: str) -> List[int]:
+        # Name positions worth scoring: rows sharing the most trigrams with q
+        if len(q) < NGRAM:
+            return list(range(len(self.names)))
+        lists = [self.postings[g] for g in _grams(q) if g in self.postings]
+        if not lists:
+            return []
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.joined))
+        rows = np.flatnonzero(shared)
+        if len(rows) > MAX_FUZZY_ROWS:
+            rows = rows[np.argsort(-shared[rows], kind="stable")[:MAX_FUZZY_ROWS]]
+        return [
+            i for r in np.sort(rows).tolist()
+            for i in range(self.name_offsets[r], self.name_offsets[r + 1])
+        ]
+
+    def resolve(self, title: str, threshold: int = 80) -> List[Tuple[int, float]]:
+        # (row, score) for every anime with a title equal to or fuzzy-matching
+        # `title` at fuzz.ratio >= threshold, best first
+        q = title.strip().lower() if isinstance(title, str) else ""
+        if not q:
+            return []
+
+        best: Dict[int, float] = {row: 100.0 for row in self.exact.get(q, [])}
+
+        pool = self._fuzzy_pool(q)
+        if pool:
+            choices = [self.names[i] for i in pool]
+            for _, score, pos in process.extract(
+                q, choices, scorer=fuzz.ratio, score_cutoff=threshold, limit=None
+            ):
+                row = self.name_rows[pool[pos]]
+                if score > best.get(row, -1):
+                    best[row] = score
+
+        return sorted(best.items(), key=lambda x: (-x[1], x[0]))
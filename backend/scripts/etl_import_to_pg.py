@@ -1,78 +1,58 @@
-import os, json
+import os, sys
 from pathlib import Path
 import psycopg
 from psycopg.rows import dict_row
 from dotenv import load_dotenv
 
+# Make `app` importable for the snapshot export
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.services.db_loader import export_catalog_snapshot, notify_catalog_changed
+from pg_bulk import bulk_upsert
+from json_stream import iter_json_records
+
 # Load .env to get DATABASE_URL
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 EMBED_DIM = int(os.getenv("EMBED_DIM", "1536"))
 
-# Path to your anime_data.json
-DATA_PATH = Path(__file__).resolve().parents[1] / "app" / "data" / "anime_data.json"
+# Path to your anime_data.json (a JSON array, or NDJSON such as a fetcher backup; .gz is fine)
+DATA_PATH = Path(os.getenv("ANIME_DATA_PATH", Path(__file__).resolve().parents[1] / "app" / "data" / "anime_data.json"))
 
 def main():
     if not DATA_PATH.exists():
-        raise FileNotFoundError(f"anime_data.json not found at {DATA_PATH}")
-
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    print(f"[INFO] Loaded {len(data)} anime entries from JSON")
+        raise FileNotFoundError(f"Anime data not found at {DATA_PATH}")
+
+    # Records are parsed one at a time and copied straight to Postgres, so
+    # memory stays flat however large the file is
+    def rows():
+        for a in iter_json_records(DATA_PATH):
+            yield {
+                "id": int(a["id"]),
+                "title": a.get("title"),
+                "all_titles": list({t for t in (a.get("all_titles") or []) if t}),
+                "main_picture": a.get("main_picture") or None,
+                "tags": [t.lower() for t in (a.get("tags") or []) if t],
+                "synopsis": a.get("synopsis"),
+                "rating": a.get("rating"),
+                "is_nsfw": bool(a.get("is_nsfw", False)),
+                "total_episodes": int(a.get("total_episodes") or 0),
+                "children_ids": a.get("children_ids") or [],
+                "last_updated": a.get("last_updated"),
+                "embedding": a.get("embedding") or None
+            }
 
     with psycopg.connect(DATABASE_URL, row_factory=dict_row) as conn:
-        with conn.cursor() as cur:
-            upsert_sql = """
-            INSERT INTO anime (
-                id, title, all_titles, main_picture, tags, synopsis, rating,
-                is_nsfw, total_episodes, children_ids, last_updated, embedding
-            )
-            VALUES (
-                %(id)s, %(title)s, %(all_titles)s, %(main_picture)s, %(tags)s,
-                %(synopsis)s, %(rating)s, %(is_nsfw)s, %(total_episodes)s,
-                %(children_ids)s, %(last_updated)s, %(embedding)s
-            )
-            ON CONFLICT (id) DO UPDATE SET
-              title = EXCLUDED.title,
-              all_titles = EXCLUDED.all_titles,
-              main_picture = EXCLUDED.main_picture,
-              tags = EXCLUDED.tags,
-              synopsis = EXCLUDED.synopsis,
-              rating = EXCLUDED.rating,
-              is_nsfw = EXCLUDED.is_nsfw,
-              total_episodes = EXCLUDED.total_episodes,
-              children_ids = EXCLUDED.children_ids,
-              last_updated = EXCLUDED.last_updated,
-              embedding = EXCLUDED.embedding;
-            """
-
-            batch_size = 50
-            for i in range(0, len(data), batch_size):
-                batch = data[i:i+batch_size]
-                rows = []
-                for a in batch:
-                    row = {
-                        "id": int(a["id"]),
-                        "title": a.get("title"),
-                        "all_titles": list({t for t in (a.get("all_titles") or []) if t}),
-                        "main_picture": json.dumps(a.get("main_picture")) if a.get("main_picture") else None,
-                        "tags": [t.lower() for t in (a.get("tags") or []) if t],
-                        "synopsis": a.get("synopsis"),
-                        "rating": a.get("rating"),
-                        "is_nsfw": bool(a.get("is_nsfw", False)),
-                        "total_episodes": int(a.get("total_episodes") or 0),
-                        "children_ids": a.get("children_ids") or [],
-                        "last_updated": a.get("last_updated"),
-                        "embedding": a.get("embedding") or None
-                    }
-                    rows.append(row)
-
-                cur.executemany(upsert_sql, rows)
-                conn.commit()
-                print(f"[INFO] Inserted/updated {i+len(batch)} / {len(data)}")
+        # COPY into a staging table, one merge, one commit
+        bulk_upsert(conn, rows(), label="Inserted/updated")
 
     print("✅ Import complete!")
 
+    # Export before notifying, so woken API workers load the snapshot with
+    # its neighbour lists instead of delta-refreshing to the same version
+    try:
+        export_catalog_snapshot()
+    finally:
+        notify_catalog_changed()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+import os, json, gzip
+from datetime import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# -------------------
+# Settings
+# -------------------
+JSON_READ_CHUNK = int(os.getenv("JSON_READ_CHUNK", str(1 << 16)))  # characters read per refill
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",]"
+
+def _open_text(path, mode):
+    # .gz files are (de)compressed on the fly
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+# ---------- Reading ----------
+def iter_json_array(f, chunk_size=JSON_READ_CHUNK):
+    """Yield the items of the top-level JSON array in text file ``f`` one by one.
+
+    Only the current item and one read chunk are held in memory, so a catalog
+    dump with embeddings can be imported without loading the whole file.
+    """
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        # Drop what was consumed and append one chunk; False at end of file
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        buf, pos = buf[pos:] + chunk, 0
+        eof = not chunk
+        return not eof
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    skip_whitespace()
+    if buf[pos:pos + 1] != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    skip_whitespace()
+    if buf[pos:pos + 1] == "]":
+        return
+
+    while True:
+        while True:
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # A number cut off by the end of the buffer ("12" of "12.5") also
+            # decodes, so only trust an item followed by a delimiter
+            if (end == len(buf) or buf[end] not in _DELIMITERS) and not eof and fill():
+                continue
+            break
+        pos = end
+        yield item
+
+        skip_whitespace()
+        sep = buf[pos:pos + 1]
+        pos += 1
+        if sep == "]":
+            return
+        if sep != ",":
+            raise ValueError(f"Expected ',' or ']' in JSON array, got {sep!r}")
+        skip_whitespace()
+
+def iter_json_records(path):
+    """Yield the records of a JSON array file or an NDJSON file (either may be .gz)."""
+    with _open_text(path, "r") as f:
+        first = f.read(1)
+        while first and first in _WHITESPACE:
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from iter_json_array(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# ---------- Writing ----------
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Type {obj.__class__.__name__} not serializable")
+
+class NDJSONWriter:
+    """Append-only NDJSON writer, gzip-compressed when ``path`` ends in .gz.
+
+    Each ``write`` emits one compact line, so records can be written as soon
+    as they are final instead of building one big document at the end. Lines
+    go to ``<path>.partial``, which only becomes ``path`` on ``commit()`` (or
+    a clean exit from the ``with`` block) and is deleted otherwise, so a failed
+    run never leaves a truncated file that looks complete.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.count = 0
+        self._partial = self.path.with_name(self.path.name + ".partial")
+        self._f = gzip.open(self._partial, "wt", encoding="utf-8") if self.path.suffix == ".gz" \
+            else open(self._partial, "w", encoding="utf-8")
+
+    def write(self, record):
+        self._f.write(json.dumps(record, ensure_ascii=False, default=_json_default))
+        self._f.write("\n")
+        self.count += 1
+
+    def commit(self):
+        self._f.close()
+        os.replace(self._partial, self.path)
+
+    def discard(self):
+        self._f.close()
+        self._partial.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
@@ -0,0 +1,165 @@
+import os, json, time, sqlite3, threading
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# -------------------
+# Settings
+# -------------------
+DATA_DIR = Path(__file__).resolve().parents[1] / "app" / "data"
+MAL_CACHE_PATH = Path(os.getenv("MAL_CACHE_PATH", DATA_DIR / "mal_cache.sqlite3"))
+MAL_CACHE_ONLY = os.getenv("MAL_CACHE_ONLY", "0") == "1"  # rebuild offline: no MAL call at all, lists and details come from the cache
+
+DAY = 24 * 3600
+TTL_FINISHED = float(os.getenv("MAL_CACHE_TTL_FINISHED_DAYS", "180")) * DAY
+TTL_AIRING = float(os.getenv("MAL_CACHE_TTL_AIRING_HOURS", "12")) * 3600
+TTL_UPCOMING = float(os.getenv("MAL_CACHE_TTL_UPCOMING_DAYS", "3")) * DAY
+
+# Seconds an entry stays fresh, per field and per MAL airing status
+# (None = forever). Unknown statuses use the "not_yet_aired" TTL.
+FIELD_TTLS = {
+    "related_anime": {
+        "finished_airing": TTL_FINISHED,
+        "currently_airing": TTL_AIRING,
+        "not_yet_aired": TTL_UPCOMING,
+    },
+    "num_episodes": {
+        "finished_airing": None,  # a finished show's episode count is final
+        "currently_airing": TTL_AIRING,
+        "not_yet_aired": TTL_UPCOMING,
+    },
+}
+
+# ---------- Cache ----------
+class MALDetailCache:
+    """SQLite cache for per-anime MAL detail fields (related_anime, num_episodes).
+
+    The nodes of the last successful ranking and season list pages are kept
+    too, so a cache-only run can rebuild the catalog without the API. Entries
+    remember the anime's airing status, so finished series stay cached
+    for a long time and airing ones are re-checked often. Expired entries are
+    revalidated with If-None-Match / If-Modified-Since when MAL sent an ETag or
+    Last-Modified, and served stale if the API call fails. In cache-only mode
+    the API is never called and misses return None.
+    """
+
+    def __init__(self, path=MAL_CACHE_PATH, cache_only=MAL_CACHE_ONLY):
+        self.path = Path(path)
+        self.cache_only = cache_only
+        self._local = threading.local()
+        self.stats = {"fresh": 0, "stale": 0, "revalidated": 0, "fetched": 0, "missing": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS mal_detail_cache (
+                    anime_id INTEGER NOT NULL,
+                    field TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    status TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (anime_id, field)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS mal_list_cache (
+                    key TEXT PRIMARY KEY,
+                    nodes TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def ttl(field, status):
+        ttls = FIELD_TTLS.get(field, {})
+        return ttls.get(status, ttls.get("not_yet_aired", TTL_UPCOMING))
+
+    def _row(self, anime_id, field):
+        return self._conn().execute(
+            "SELECT value, status, etag, last_modified, fetched_at FROM mal_detail_cache "
+            "WHERE anime_id = ? AND field = ?",
+            (anime_id, field)
+        ).fetchone()
+
+    def _store(self, anime_id, field, value, status, etag, last_modified):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO mal_detail_cache "
+            "(anime_id, field, value, status, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (anime_id, field, json.dumps(value, ensure_ascii=False), status, etag, last_modified, time.time())
+        )
+
+    def _touch(self, anime_id, field):
+        self._conn().execute(
+            "UPDATE mal_detail_cache SET fetched_at = ? WHERE anime_id = ? AND field = ?",
+            (time.time(), anime_id, field)
+        )
+
+    def get(self, anime_id, field, mal):
+        """The cached or freshly fetched ``field`` of ``anime_id``, or None if unavailable."""
+        row = self._row(anime_id, field)
+        if row is not None:
+            value, status, etag, last_modified, fetched_at = row
+            ttl = self.ttl(field, status)
+            if self.cache_only or ttl is None or time.time() - fetched_at < ttl:
+                self._count("fresh")
+                return json.loads(value)
+        if self.cache_only:
+            self._count("missing")
+            return None
+
+        headers = {}
+        if row is not None and row[2]:
+            headers["If-None-Match"] = row[2]
+        if row is not None and row[3]:
+            headers["If-Modified-Since"] = row[3]
+        r = mal.request(f"anime/{anime_id}", params={"fields": f"{field},status"}, headers=headers or None)
+
+        if r is not None and r.status_code == 304 and row is not None:
+            self._touch(anime_id, field)
+            self._count("revalidated")
+            return json.loads(row[0])
+        if r is not None and r.status_code == 200:
+            try:
+                data = r.json()
+            except ValueError:
+                data = None
+            if data is not None:
+                value = data.get(field)
+                self._store(anime_id, field, value, data.get("status"),
+                            r.headers.get("ETag"), r.headers.get("Last-Modified"))
+                self._count("fetched")
+                return value
+
+        # API failed: an expired entry beats nothing
+        if row is not None:
+            self._count("stale")
+            return json.loads(row[0])
+        self._count("missing")
+        return None
+
+    # ---------- List Pages ----------
+    def get_list(self, key):
+        """The nodes last stored under list page ``key``, or None."""
+        row = self._conn().execute("SELECT nodes FROM mal_list_cache WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_list(self, key, nodes):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO mal_list_cache (key, nodes, fetched_at) VALUES (?, ?, ?)",
+            (key, json.dumps(nodes, ensure_ascii=False), time.time())
+        )
@@ -0,0 +1,172 @@
+import os, time, random, threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# -------------------
+# Settings (MAL_API_BASE can point at a local stub server for testing)
+# -------------------
+MAL_API_BASE = os.getenv("MAL_API_BASE", "https://api.myanimelist.net/v2").rstrip("/")
+MAL_RATE = float(os.getenv("MAL_RATE", "3"))              # sustained requests per second
+MAL_BURST = int(os.getenv("MAL_BURST", "5"))              # bucket size
+MAL_CONCURRENCY = int(os.getenv("MAL_CONCURRENCY", "8"))  # max in-flight requests
+MAL_RETRIES = int(os.getenv("MAL_RETRIES", "5"))
+MAL_BACKOFF = float(os.getenv("MAL_BACKOFF", "1"))        # base backoff seconds
+MAL_BACKOFF_MAX = float(os.getenv("MAL_BACKOFF_MAX", "60"))
+MAL_TIMEOUT = float(os.getenv("MAL_TIMEOUT", "45"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# ---------- Rate Limiter ----------
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, at most ``burst`` saved up."""
+
+    def __init__(self, rate=MAL_RATE, burst=MAL_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        # Caller holds the lock
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Server asked us to back off: nobody gets a token for `seconds`.
+        # Concurrent 429s overlap instead of stacking their waits.
+        # Refill first, or the next acquire() credits the idle time before the
+        # pause and wipes out the debt.
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+# ---------- Helpers ----------
+def retry_after_seconds(value):
+    # Retry-After is either delta-seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=MAL_BACKOFF, cap=MAL_BACKOFF_MAX):
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+# ---------- Client ----------
+class MALClient:
+    """Pooled, rate-limited MAL API client shared by all fetch threads.
+
+    Every request waits for a token from one shared bucket and for one of
+    ``concurrency`` in-flight slots. 429 and 5xx responses and network errors
+    are retried with jittered exponential backoff, honouring ``Retry-After``.
+    ``get`` returns the decoded JSON, or None once retries are exhausted or on
+    any other error status; ``request`` returns the raw 200/304 response for
+    conditional requests.
+    """
+
+    def __init__(self, token, base_url=MAL_API_BASE, rate=MAL_RATE, burst=MAL_BURST,
+                 concurrency=MAL_CONCURRENCY, retries=MAL_RETRIES, timeout=MAL_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="mal")
+        self.stats = {"requests": 0, "retries": 0, "failures": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def url(self, path):
+        # Absolute URLs (e.g. paging.next) are used as given
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, path, params=None, headers=None):
+        # The final 200/304 response, or None after an error status or retries
+        url = self.url(path)
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            delay = None
+            try:
+                with self.slots:
+                    self._count("requests")
+                    r = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+                if r.status_code in (200, 304):
+                    return r
+                if r.status_code not in RETRY_STATUSES:
+                    print(f"[ERROR] {r.status_code} for {url} - {r.text[:200]}")
+                    self._count("failures")
+                    return None
+                delay = retry_after_seconds(r.headers.get("Retry-After"))
+                if delay is not None:
+                    self.bucket.pause(delay)
+                print(f"[WARN] {r.status_code} for {url} attempt {attempt + 1}/{self.retries + 1}")
+            except RequestException as e:
+                print(f"[WARN] Network error for {url} attempt {attempt + 1}/{self.retries + 1}: {e}")
+            if attempt < self.retries:
+                self._count("retries")
+                # With Retry-After the bucket is already in debt, acquire() waits it out
+                if delay is None:
+                    time.sleep(backoff_delay(attempt))
+        self._count("failures")
+        return None
+
+    def get(self, path, params=None):
+        r = self.request(path, params=params)
+        if r is None:
+            return None
+        try:
+            return r.json()
+        except ValueError as e:
+            print(f"[ERROR] Invalid JSON from {r.url}: {e}")
+            return None
+
+    def map(self, fn, items):
+        # fn over items on the client's threads, results in input order
+        return list(self.executor.map(fn, items))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,77 @@
+import sys, json, time, threading, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from mal_client import MALClient
+
+# Run as `python backend/scripts/mal_client_check.py`: checks against a local
+# stub server that the client honours Retry-After without stacking it.
+
+# ---------- Stub MAL ----------
+class StubMAL(BaseHTTPRequestHandler):
+    retry_after = 2.0
+    latency = 0.5          # seconds before a 429 is answered
+    hits = []              # (monotonic time, path) of every request
+    throttled = set()      # paths already answered with 429
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.lock:
+            self.hits.append((time.monotonic(), self.path))
+            first = self.path not in self.throttled
+            self.throttled.add(self.path)
+        if first:
+            # Every path is throttled once, after some server latency
+            time.sleep(self.latency)
+            self.send_response(429)
+            self.send_header("Retry-After", str(self.retry_after))
+            self.end_headers()
+            return
+        body = json.dumps({"ok": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def retry_gap(path):
+    times = [t for t, p in StubMAL.hits if p.startswith(path)]
+    return times[1] - times[0]
+
+# ---------- Checks ----------
+def check(name, ok, detail):
+    print(f"[{'OK' if ok else 'FAIL'}] {name}: {detail}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check MALClient's Retry-After handling against a stub server.")
+    parser.add_argument("--retry-after", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub latency of a 429 response")
+    parser.add_argument("--idle", type=float, default=3.0, help="Idle seconds before the first request")
+    args = parser.parse_args()
+
+    StubMAL.retry_after = args.retry_after
+    StubMAL.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMAL)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    passed = True
+    wait = args.latency + args.retry_after  # first hit to retry
+    with MALClient(None, base_url=base, rate=10, burst=5, retries=2) as mal:
+        # Time spent idle or waiting on the 429 must not absorb the Retry-After debt
+        time.sleep(args.idle)
+        ok = mal.get("one") is not None
+        gap = retry_gap("/one")
+        passed &= check("single 429", ok and wait * 0.95 <= gap <= wait + 1, f"retried after {gap:.2f}s")
+
+    with MALClient(None, base_url=base, rate=10, burst=5, retries=2) as mal:
+        # Concurrent 429s overlap instead of stacking their waits
+        started = time.monotonic()
+        results = mal.map(lambda i: mal.get(f"many/{i}"), range(4))
+        took = time.monotonic() - started
+        passed &= check("concurrent 429s", all(r is not None for r in results) and took <= wait + 1.5,
+                        f"4 throttled requests done in {took:.2f}s")
+    server.shutdown()
+    sys.exit(0 if passed else 1)
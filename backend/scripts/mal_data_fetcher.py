@@ -1,11 +1,18 @@
 from datetime import datetime, timezone
-import os, re, time, json, random, psycopg, requests
-from requests.exceptions import RequestException, SSLError
+import os, re, sys, psycopg
 from psycopg.rows import dict_row
 from openai import OpenAI
 from dotenv import load_dotenv
 from pathlib import Path
 from mal_token_fetcher import get_access_token
+from mal_client import MALClient
+from mal_cache import MALDetailCache, MAL_CACHE_ONLY
+from pg_bulk import bulk_upsert
+from json_stream import NDJSONWriter
+
+# Make `app` importable for the snapshot export
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.services.db_loader import export_catalog_snapshot, notify_catalog_changed
 
 # -------------------
 # Setup
@@ -15,19 +22,23 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 EMBED_DIM = int(os.getenv("EMBED_DIM", "1536"))
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 
-client = OpenAI(api_key=OPENAI_KEY)
+# Cache-only runs reuse stored embeddings and never call OpenAI
+client = None if MAL_CACHE_ONLY else OpenAI(api_key=OPENAI_KEY)
 
 DATA_DIR = Path(__file__).resolve().parents[1] / "app" / "data"
 DATA_DIR.mkdir(exist_ok=True)
-BACKUP_FILE = DATA_DIR / f"anime_backup_{datetime.now().strftime('%Y%m%d_%H%M')}.json"
+BACKUP_GZIP = os.getenv("BACKUP_GZIP", "1") == "1"
+BACKUP_FILE = DATA_DIR / f"anime_backup_{datetime.now().strftime('%Y%m%d_%H%M')}.ndjson{'.gz' if BACKUP_GZIP else ''}"
 
-FIELDS = "id,title,main_picture,synopsis,genres,themes,media_type,episodes,status,start_date,end_date,mean,rank,popularity,rating,alternative_titles"
-RANKING_URL = "https://api.myanimelist.net/v2/anime/ranking"
-SEASON_URL = "https://api.myanimelist.net/v2/anime/season/{year}/{season}"
+FIELDS = "id,title,main_picture,synopsis,genres,themes,media_type,num_episodes,status,start_date,end_date,mean,rank,popularity,rating,alternative_titles"
+RANKING_PATH = "anime/ranking"
+SEASON_PATH = "anime/season/{year}/{season}"
 
+# Per-run memo in front of the persistent detail cache (app/data/mal_cache.sqlite3)
+detail_cache = MALDetailCache()
 relations_cache = {}
 episodes_cache = {}
-existing_titles = {}
+plan_stats = {"planned": 0, "skipped": 0}  # detail lookups sent vs answered by payloads/memos
 
 # ---------- Text Cleaning ----------
 def clean_text(text):
@@ -62,127 +73,172 @@ def clean_title(title):
     return title.strip()
 
 # ---------- Fetch Ranking ----------
-def fetch_ranking(ranking_type, limit, token):
-    headers = {"Authorization": f"Bearer {token}"}
-    all_anime = []
-    for offset in range(0, limit, 100):
-        params = {"ranking_type": ranking_type, "limit": 100, "offset": offset, "fields": FIELDS}
+def fetch_ranking(ranking_type, limit, mal):
+    # Pages are independent, so they are fetched concurrently; like before, the
+    # result stops at the first page that failed. Pages are cached for
+    # cache-only runs, which read them back instead of calling MAL.
+    def fetch_page(offset):
+        key = f"ranking/{ranking_type}/{offset}"
+        if detail_cache.cache_only:
+            return detail_cache.get_list(key)
         print(f"[INFO] Fetching {ranking_type} offset {offset}...")
-        try:
-            r = requests.get(RANKING_URL, headers=headers, params=params, timeout=45)
-            if r.status_code == 200:
-                all_anime.extend([entry["node"] for entry in r.json().get("data", [])])
-            else:
-                print(f"[ERROR] {r.status_code} - {r.text}")
-                break
-        except (RequestException, SSLError) as e:
-            print(f"[WARN] Network/SSL error during fetch_ranking offset {offset}: {e}")
+        params = {"ranking_type": ranking_type, "limit": 100, "offset": offset, "fields": FIELDS}
+        page = mal.get(RANKING_PATH, params=params)
+        if page is None:
+            return None
+        nodes = [entry["node"] for entry in page.get("data", [])]
+        detail_cache.put_list(key, nodes)
+        return nodes
+
+    all_anime = []
+    for nodes in mal.map(fetch_page, range(0, limit, 100)):
+        if nodes is None:
             break
-        time.sleep(0.5)
+        all_anime.extend(nodes)
     return all_anime
 
 # ---------- Fetch Seasonal ----------
-def fetch_season(year, season, token):
-    headers = {"Authorization": f"Bearer {token}"}
+def fetch_season(year, season, mal):
+    key = f"season/{year}/{season}"
+    if detail_cache.cache_only:
+        return detail_cache.get_list(key) or []
     params = {"fields": FIELDS, "limit": 100}
     all_anime = []
-    url = SEASON_URL.format(year=year, season=season)
+    url = SEASON_PATH.format(year=year, season=season)
     while url:
         print(f"[INFO] Fetching season {year} {season}...")
-        try:
-            r = requests.get(url, headers=headers, params=params, timeout=45)
-            if r.status_code == 200:
-                data = r.json()
-                all_anime.extend([entry["node"] for entry in data.get("data", [])])
-                url = data.get("paging", {}).get("next")
-                params = {}
-            else:
-                print(f"[ERROR] {r.status_code} - {r.text}")
-                break
-        except (RequestException, SSLError) as e:
-            print(f"[WARN] Network/SSL error during fetch_season {year} {season}: {e}")
-            break
-        time.sleep(0.5)
+        data = mal.get(url, params=params)
+        if data is None:
+            return all_anime  # incomplete, so the cached season is kept
+        all_anime.extend([entry["node"] for entry in data.get("data", [])])
+        url = data.get("paging", {}).get("next")
+        params = None
+    detail_cache.put_list(key, all_anime)
     return all_anime
 
-# ---------- Find Root Anime ----------
-def find_root_anime(anime_id, token, visited=None, anime_title=None, retries=3):
-    if visited is None:
-        visited = set()
-    if anime_id in visited:
-        return anime_id
-    visited.add(anime_id)
-
-    if anime_id in relations_cache:
-        related_anime = relations_cache[anime_id]
-    else:
-        headers = {"Authorization": f"Bearer {token}"}
-        url = f"https://api.myanimelist.net/v2/anime/{anime_id}?fields=related_anime"
-        related_anime = []
-        for attempt in range(1, retries + 1):
-            try:
-                r = requests.get(url, headers=headers, timeout=45)
-                if r.status_code == 200:
-                    data = r.json()
-                    related_anime = data.get("related_anime", [])
-                    break
-                else:
-                    print(f"[WARN] Could not fetch related_anime for {anime_id} "
-                          f"({r.status_code}) attempt {attempt}/{retries}")
-            except (RequestException, SSLError) as e:
-                print(f"[WARN] Network/SSL error for {anime_id} attempt {attempt}/{retries}: {e}")
-            time.sleep(2 * attempt)
-        relations_cache[anime_id] = related_anime
-        if related_anime:
-            time.sleep(1)
-
+# ---------- Request Planning ----------
+def dedupe_fetched(fetched):
+    # One node per id across ranking and season pages; later pages win but the
+    # first-seen order is kept
+    return list({a["id"]: a for a in fetched}.values())
+
+def seed_from_payloads(nodes):
+    # List endpoints already return num_episodes, so those ids never need an
+    # episode detail call this run (related_anime is detail-only on MAL)
+    seeded = 0
+    for node in nodes:
+        aid = node["id"]
+        if node.get("num_episodes") is not None and aid not in episodes_cache:
+            episodes_cache[aid] = node["num_episodes"]
+            seeded += 1
+    print(f"[INFO] Seeded {seeded} episode counts from list payloads")
+
+def plan_lookups(ids, memo):
+    # The ids whose detail is not known yet, counted into plan_stats
+    missing = [aid for aid in ids if aid not in memo]
+    plan_stats["planned"] += len(missing)
+    plan_stats["skipped"] += len(ids) - len(missing)
+    return missing
+
+# ---------- Fetch Relations ----------
+def fetch_relations(anime_id, mal):
+    if anime_id not in relations_cache:
+        related = detail_cache.get(anime_id, "related_anime", mal)
+        if related is None:
+            print(f"[WARN] Could not fetch related_anime for {anime_id}")
+        relations_cache[anime_id] = related or []
+    return relations_cache[anime_id]
+
+# ---------- Franchise Roots ----------
+def first_prequel(related_anime):
     for rel in related_anime:
         if rel.get("relation_type", "").lower() == "prequel":
-            return find_root_anime(rel["node"]["id"], token, visited)
-
-    if anime_title:
-        base_title = clean_title(anime_title)
-        for aid in existing_titles:
-            if aid != anime_id and clean_title(existing_titles[aid]) == base_title:
-                return aid
-    return anime_id
+            return rel["node"]["id"]
+    return None
+
+def fetch_prequel_graph(anime_ids, mal):
+    # Prequel edge of every anime reachable from anime_ids, fetched in waves:
+    # each wave requests the relations of all prequels first seen in the last
+    # one at once, so siblings sharing a prequel cost a single lookup
+    prequel_of = {}
+    seen = set(anime_ids)
+    frontier = list(dict.fromkeys(anime_ids))
+    while frontier:
+        mal.map(lambda aid: fetch_relations(aid, mal), plan_lookups(frontier, relations_cache))
+        related = [relations_cache[aid] for aid in frontier]
+        next_frontier = []
+        for aid, rels in zip(frontier, related):
+            prequel = first_prequel(rels)
+            if prequel is None:
+                continue
+            prequel_of[aid] = prequel
+            if prequel not in seen:
+                seen.add(prequel)
+                next_frontier.append(prequel)
+        frontier = next_frontier
+    return prequel_of
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = x
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while x != root:  # path compression
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def attach(self, child, parent):
+        # Hang child's tree under parent's root; a cycle leaves it where it is
+        child_root, parent_root = self.find(child), self.find(parent)
+        if child_root != parent_root:
+            self.parent[child_root] = parent_root
+
+def resolve_roots(new_data, mal):
+    # anime id -> franchise root: the end of its prequel chain, or, for anime
+    # without a prequel, the first earlier anime with the same clean title
+    prequel_of = fetch_prequel_graph([a["id"] for a in new_data], mal)
+    forest = UnionFind()
+    for aid, prequel in prequel_of.items():
+        forest.attach(aid, prequel)
+
+    by_clean_title = {}
+    roots = {}
+    for anime in new_data:
+        anime_id = anime["id"]
+        base_title = clean_title(anime["title"])
+        by_clean_title.setdefault(base_title, anime_id)
+        if anime_id in prequel_of:
+            roots[anime_id] = forest.find(anime_id)
+        else:
+            roots[anime_id] = by_clean_title[base_title]
+    return roots
 
 # ---------- Get Episodes Count ----------
-def get_episodes_count(anime_id, token, retries=3):
+def get_episodes_count(anime_id, mal):
     if anime_id in episodes_cache:
         return episodes_cache[anime_id]
 
-    headers = {"Authorization": f"Bearer {token}"}
-    url = f"https://api.myanimelist.net/v2/anime/{anime_id}?fields=num_episodes"
-
-    for attempt in range(1, retries + 1):
-        try:
-            r = requests.get(url, headers=headers, timeout=45)
-            if r.status_code == 200:
-                episodes = r.json().get("num_episodes") or 0
-                episodes_cache[anime_id] = episodes
-                time.sleep(0.5)
-                return episodes
-            else:
-                print(f"[WARN] Could not fetch episodes for {anime_id} "
-                      f"({r.status_code}) attempt {attempt}/{retries}")
-        except (RequestException, SSLError) as e:
-            print(f"[WARN] Network/SSL error for {anime_id} attempt {attempt}/{retries}: {e}")
-        time.sleep(1.5 * attempt)
-
-    episodes_cache[anime_id] = 0
-    return 0
+    episodes = detail_cache.get(anime_id, "num_episodes", mal)
+    if episodes is None:
+        print(f"[WARN] Could not fetch episodes for {anime_id}")
+    episodes = episodes or 0
+    episodes_cache[anime_id] = episodes
+    return episodes
 
 # ---------- Build Grouped DB ----------
-def build_grouped_db(new_data, existing_data, token):
+def build_grouped_db(new_data, existing_data, mal):
     grouped_data = {}
+    new_data = list(new_data)
     total = len(new_data)
+    roots = resolve_roots(new_data, mal)
 
     for i, anime in enumerate(new_data, start=1):
         anime_id = anime["id"]
         anime_title = anime["title"]
-        existing_titles[anime_id] = anime_title
-        root_id = find_root_anime(anime_id, token, anime_title=anime_title)
+        root_id = roots[anime_id]
 
         if root_id not in grouped_data:
             # Collect alternative titles
@@ -222,10 +278,13 @@ def build_grouped_db(new_data, existing_data, token):
 
     # ---------- EPISODE FETCH PROGRESS ----------
     total_roots = len(grouped_data)
+    child_ids = list(dict.fromkeys(cid for entry in grouped_data.values() for cid in entry["children_ids"]))
+    missing = plan_lookups(child_ids, episodes_cache)
+    mal.map(lambda cid: get_episodes_count(cid, mal), missing)
+    print(f"[INFO] Episode counts fetched for {len(missing)} of {len(child_ids)} anime")
+
     for j, (root_id, entry) in enumerate(grouped_data.items(), start=1):
         all_child_ids = entry["children_ids"]
-        for cid in all_child_ids:
-            get_episodes_count(cid, token)
         entry["total_episodes"] = sum(episodes_cache.get(cid, 0) for cid in all_child_ids)
         existing_data[root_id] = entry
 
@@ -242,7 +301,11 @@ def embed_batch(texts):
 
 # ---------- Main ----------
 if __name__ == "__main__":
-    token = get_access_token()
+    if detail_cache.cache_only:
+        print("[INFO] Cache-only run: MAL lists and details come from the local cache")
+        token = None
+    else:
+        token = get_access_token()
 
     # Load existing DB
     with psycopg.connect(DATABASE_URL, row_factory=dict_row) as conn:
@@ -251,8 +314,9 @@ if __name__ == "__main__":
     print(f"[INFO] Loaded {len(existing_data)} existing entries from DB.")
 
     # Fetch MAL
+    mal = MALClient(token)
     fetched = []
-    fetched.extend(fetch_ranking("bypopularity", 10000, token))
+    fetched.extend(fetch_ranking("bypopularity", 10000, mal))
 
     now = datetime.now()
     current_year = now.year
@@ -261,10 +325,13 @@ if __name__ == "__main__":
     prev_season = "fall" if current_season == "winter" else "winter" if current_season == "spring" else "spring" if current_season == "summer" else "summer"
     prev_year = current_year - 1 if current_season == "winter" else current_year
 
-    fetched.extend(fetch_season(current_year, current_season, token))
-    fetched.extend(fetch_season(prev_year, prev_season, token))
+    fetched.extend(fetch_season(current_year, current_season, mal))
+    fetched.extend(fetch_season(prev_year, prev_season, mal))
 
-    print(f"[INFO] Total fetched {len(fetched)} entries")
+    total_fetched = len(fetched)
+    fetched = dedupe_fetched(fetched)
+    print(f"[INFO] Total fetched {total_fetched} entries, {len(fetched)} unique")
+    seed_from_payloads(fetched)
 
     # Filter: new or airing
     fetched_unique = {}
@@ -277,7 +344,10 @@ if __name__ == "__main__":
     print(f"[INFO] {len(fetched_unique)} anime need update (new or airing).")
 
     # Build + merge
-    updated_data = build_grouped_db(fetched_unique.values(), existing_data, token)
+    updated_data = build_grouped_db(fetched_unique.values(), existing_data, mal)
+    mal.close()
+    print(f"[INFO] Detail lookups planned {plan_stats['planned']}, skipped {plan_stats['skipped']}")
+    print(f"[INFO] MAL requests: {mal.stats}, detail cache: {detail_cache.stats}")
     anime_list = []
     missing_ids = []
 
@@ -292,81 +362,65 @@ if __name__ == "__main__":
             f"{missing_ids[:10]}{'...' if len(missing_ids) > 10 else ''}")
 
     # Embeddings
-    print("[INFO] Generating embeddings...")
     batch_size = 100
-    for i in range(0, len(anime_list), batch_size):
-        batch = anime_list[i:i+batch_size]
-        texts = [a.get("synopsis") or "N/A" for a in batch]
-
-        try:
-            embeddings = embed_batch(texts)
-            for a, emb in zip(batch, embeddings):
-                a["embedding"] = emb
-        except Exception as e:
-            print(f"[ERROR] Embedding batch {i//batch_size+1}: {e}")
-            # Ensure all entries still have an embedding field
-            for a in batch:
-                a["embedding"] = None
-
-    # Upsert into Postgres
-    upsert_sql = """
-    INSERT INTO anime (
-        id, title, all_titles, main_picture, tags, synopsis, rating,
-        is_nsfw, total_episodes, children_ids, last_updated, embedding
-    )
-    VALUES (
-        %(id)s, %(title)s, %(all_titles)s, %(main_picture)s, %(tags)s,
-        %(synopsis)s, %(rating)s, %(is_nsfw)s, %(total_episodes)s,
-        %(children_ids)s, %(last_updated)s, %(embedding)s
-    )
-    ON CONFLICT (id) DO UPDATE SET
-    title = EXCLUDED.title,
-    all_titles = EXCLUDED.all_titles,
-    main_picture = EXCLUDED.main_picture,
-    tags = EXCLUDED.tags,
-    synopsis = EXCLUDED.synopsis,
-    rating = EXCLUDED.rating,
-    is_nsfw = EXCLUDED.is_nsfw,
-    total_episodes = EXCLUDED.total_episodes,
-    children_ids = EXCLUDED.children_ids,
-    last_updated = EXCLUDED.last_updated,
-    embedding = EXCLUDED.embedding;
-    """
+    if client is None:
+        # Cache-only: entries already in the DB keep their embedding
+        unembedded = sum(1 for a in anime_list if a.get("embedding") is None)
+        print(f"[INFO] Keeping stored embeddings; {unembedded} new entries have none")
+    else:
+        print("[INFO] Generating embeddings...")
+        for i in range(0, len(anime_list), batch_size):
+            batch = anime_list[i:i+batch_size]
+            texts = [a.get("synopsis") or "N/A" for a in batch]
 
-    with psycopg.connect(DATABASE_URL, row_factory=dict_row) as conn:
-        with conn.cursor() as cur:
-            batch_size = 50
-            for i in range(0, len(anime_list), batch_size):
-                rows = []
-                for a in anime_list[i:i+batch_size]:
-                    row = {
-                        "id": int(a["id"]),
-                        "title": a.get("title"),
-                        "all_titles": list({t for t in (a.get("all_titles") or []) if t}),
-                        "main_picture": json.dumps(a.get("main_picture")) if a.get("main_picture") else None,
-                        "tags": [t for t in (a.get("tags") or []) if t],
-                        "synopsis": a.get("synopsis"),
-                        "rating": a.get("rating"),
-                        "is_nsfw": bool(a.get("is_nsfw", False)),
-                        "total_episodes": int(a.get("total_episodes") or 0),
-                        "children_ids": a.get("children_ids") or [],
-                        "last_updated": a.get("last_updated"),
-                        "embedding": a.get("embedding") or None,
-                    }
-                    rows.append(row)
-
-                cur.executemany(upsert_sql, rows)
-                conn.commit()
-                print(f"[INFO] Upserted {i+len(rows)}/{len(anime_list)}")
-
-    # Save backup JSON snapshot
-    def _json_default(obj):
-        if isinstance(obj, (datetime, )):
-            return obj.isoformat()
-        raise TypeError(f"Type {obj.__class__.__name__} not serializable")
-
-    with open(BACKUP_FILE, "w", encoding="utf-8") as f:
-        json.dump(list(updated_data.values()), f, indent=2, ensure_ascii=False, default=_json_default)
-    print(f"[INFO] Backup JSON saved to {BACKUP_FILE}")
+            try:
+                embeddings = embed_batch(texts)
+                for a, emb in zip(batch, embeddings):
+                    a["embedding"] = emb
+            except Exception as e:
+                print(f"[ERROR] Embedding batch {i//batch_size+1}: {e}")
+                # Ensure all entries still have an embedding field
+                for a in batch:
+                    a["embedding"] = None
+
+    # Upsert into Postgres; each entry goes to the NDJSON backup as it is
+    # copied, the untouched rest of the catalog follows. The backup only gets
+    # its final name once the upsert has committed.
+    written = set()
+
+    def rows(backup):
+        for a in anime_list:
+            backup.write(a)
+            written.add(a["id"])
+            yield {
+                "id": int(a["id"]),
+                "title": a.get("title"),
+                "all_titles": list({t for t in (a.get("all_titles") or []) if t}),
+                "main_picture": a.get("main_picture") or None,
+                "tags": [t for t in (a.get("tags") or []) if t],
+                "synopsis": a.get("synopsis"),
+                "rating": a.get("rating"),
+                "is_nsfw": bool(a.get("is_nsfw", False)),
+                "total_episodes": int(a.get("total_episodes") or 0),
+                "children_ids": a.get("children_ids") or [],
+                "last_updated": a.get("last_updated"),
+                "embedding": a.get("embedding") or None,
+            }
+
+    with NDJSONWriter(BACKUP_FILE) as backup:
+        with psycopg.connect(DATABASE_URL, row_factory=dict_row) as conn:
+            bulk_upsert(conn, rows(backup), total=len(anime_list))
+
+        for entry in updated_data.values():
+            if entry["id"] not in written:
+                backup.write(entry)
+    print(f"[INFO] Backup of {backup.count} entries saved to {BACKUP_FILE}")
 
     print(f"Finished update: {len(fetched_unique)} anime updated/inserted, {len(existing_data)-len(fetched_unique)} skipped.")
+
+    # Export before notifying, so woken API workers load the snapshot with
+    # its neighbour lists instead of delta-refreshing to the same version
+    try:
+        export_catalog_snapshot()
+    finally:
+        notify_catalog_changed()
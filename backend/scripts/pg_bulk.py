@@ -0,0 +1,156 @@
+import os, json, time
+from datetime import datetime, timezone
+from psycopg import pq, ProgrammingError
+from psycopg.rows import tuple_row
+from psycopg.types.json import Json, Jsonb
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# -------------------
+# Settings
+# -------------------
+BULK_PROGRESS_EVERY = int(os.getenv("BULK_PROGRESS_EVERY", "1000"))  # rows between progress lines
+
+ANIME_COLUMNS = [
+    "id", "title", "all_titles", "main_picture", "tags", "synopsis", "rating",
+    "is_nsfw", "total_episodes", "children_ids", "last_updated", "embedding",
+]
+
+# ---------- Column Types ----------
+def column_types(conn, table, columns):
+    # name -> (type oid, type name) of the given columns, as declared on the server
+    with conn.cursor(row_factory=tuple_row) as cur:
+        cur.execute(
+            "SELECT a.attname, a.atttypid::int, t.typname FROM pg_attribute a "
+            "JOIN pg_type t ON t.oid = a.atttypid "
+            "WHERE a.attrelid = %s::regclass AND a.attname = ANY(%s) AND NOT a.attisdropped",
+            (table, list(columns))
+        )
+        return {name: (oid, typname) for name, oid, typname in cur.fetchall()}
+
+def has_binary_dumper(conn, oid):
+    try:
+        conn.adapters.get_dumper_by_oid(oid, pq.Format.BINARY)
+        return True
+    except ProgrammingError:
+        return False
+
+def _text_literal(value):
+    # Types psycopg cannot dump (e.g. pgvector's vector) go over COPY as their
+    # text input form; lists use the "[a,b,...]" vector syntax
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(str(v) for v in value) + "]"
+    return str(value)
+
+def _converter(typname, known):
+    if not known:
+        return _text_literal
+    if typname in ("json", "jsonb"):
+        wrap = Jsonb if typname == "jsonb" else Json
+        def to_json(value):
+            if isinstance(value, str):
+                value = json.loads(value)
+            return None if value is None else wrap(value)
+        return to_json
+    if typname in ("timestamptz", "timestamp", "date"):
+        # Binary dumpers refuse a datetime whose awareness does not match the
+        # column, where the server used to cast: naive means UTC for
+        # timestamptz, an offset is dropped for timestamp
+        def to_datetime(value):
+            if isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            if not isinstance(value, datetime):
+                return value
+            if typname == "timestamptz" and value.tzinfo is None:
+                return value.replace(tzinfo=timezone.utc)
+            if typname == "timestamp" and value.tzinfo is not None:
+                return value.replace(tzinfo=None)
+            if typname == "date":
+                return value.date()
+            return value
+        return to_datetime
+    if typname == "text":
+        def to_text(value):
+            if isinstance(value, (dict, list)):
+                return json.dumps(value, ensure_ascii=False)
+            return value
+        return to_text
+    return lambda value: value
+
+# ---------- Bulk Upsert ----------
+def bulk_upsert(conn, rows, table="anime", columns=ANIME_COLUMNS, key="id", stamp="last_updated",
+                label="Upserted", total=None):
+    """Upsert ``rows`` (dicts keyed by ``columns``) into ``table`` in one transaction.
+
+    Rows are streamed with ``COPY ... FROM STDIN`` into an unlogged staging
+    table, in binary format when psycopg has a binary dumper for every column
+    type and in text format otherwise (e.g. a pgvector ``embedding``), then
+    merged with a single ``INSERT ... ON CONFLICT`` and committed once. ``rows``
+    may be any iterable (e.g. a generator over a streamed file) and is consumed
+    once; ``total`` is only used for progress output. Later rows win over
+    earlier ones with the same key. Existing rows are only rewritten when a
+    column other than ``stamp`` differs, and then get ``stamp = now()``.
+    Returns (inserted, updated).
+    """
+    started = time.monotonic()
+    staging = f"{table}_staging_{os.getpid()}"
+    cols = ", ".join(columns)
+
+    with conn.cursor(row_factory=tuple_row) as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {staging}")
+        cur.execute(f"CREATE UNLOGGED TABLE {staging} (LIKE {table} INCLUDING DEFAULTS)")
+        # Arrival order, so duplicate keys can be resolved to the last row
+        cur.execute(f"ALTER TABLE {staging} ADD COLUMN _seq bigint GENERATED ALWAYS AS IDENTITY")
+
+        types = column_types(conn, staging, columns)
+        known = {c: has_binary_dumper(conn, types[c][0]) for c in columns}
+        binary = all(known.values())
+        convert = [_converter(types[c][1], known[c]) for c in columns]
+        # Unknown types are sent as text and parsed by the server
+        oids = [types[c][0] if known[c] else conn.adapters.types["text"].oid for c in columns]
+
+        fmt = "BINARY" if binary else "TEXT"
+        of_total = f"/{total}" if total is not None else ""
+        print(f"[INFO] COPY into {staging} ({fmt.lower()} format)")
+        copied = 0
+        with cur.copy(f"COPY {staging} ({cols}) FROM STDIN (FORMAT {fmt})") as copy:
+            copy.set_types(oids)
+            for row in rows:
+                copy.write_row([conv(row.get(c)) for conv, c in zip(convert, columns)])
+                copied += 1
+                if copied % BULK_PROGRESS_EVERY == 0:
+                    print(f"[INFO] Copied {copied}{of_total}")
+        print(f"[INFO] Copied {copied}{of_total} rows")
+
+        # ON CONFLICT cannot touch a row twice in one statement. Rows whose
+        # content did not change are left alone; changed ones get a fresh
+        # `stamp`, which the catalog version and delta watermark are built on
+        content = [c for c in columns if c not in (key, stamp)]
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in content)
+        if stamp in columns:
+            updates += f", {stamp} = now()"
+        # Compared as text: json and some extension types have no equality operator
+        current = ", ".join(f"{table}.{c}::text" for c in content)
+        incoming = ", ".join(f"EXCLUDED.{c}::text" for c in content)
+        cur.execute(
+            f"WITH merged AS ("
+            f"INSERT INTO {table} ({cols}) "
+            f"SELECT DISTINCT ON ({key}) {cols} FROM {staging} ORDER BY {key}, _seq DESC "
+            f"ON CONFLICT ({key}) DO UPDATE SET {updates} "
+            f"WHERE ROW({current}) IS DISTINCT FROM ROW({incoming}) "
+            f"RETURNING (xmax = 0) AS inserted"
+            f") SELECT count(*) FILTER (WHERE inserted), count(*), "
+            f"(SELECT count(DISTINCT {key}) FROM {staging}) FROM merged"
+        )
+        inserted, merged, distinct = cur.fetchone()
+        cur.execute(f"DROP TABLE {staging}")
+    conn.commit()
+
+    updated = merged - inserted
+    print(f"[INFO] {label} {merged} rows into {table} from {copied} copied "
+          f"({inserted} inserted, {updated} updated, {distinct - merged} unchanged) "
+          f"in {time.monotonic() - started:.1f}s")
+    return inserted, updated
@@ -0,0 +1,56 @@
+import sys, time, argparse
+from pathlib import Path
+import numpy as np
+
+# Run as `python backend/scripts/vector_index_bench.py`; make `app` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services.db_loader import refresh_catalog
+from app.recommender.vector_index import BruteForceIndex, IVFIndex, PgVectorIndex
+
+# ---------- Recall / latency against exact search ----------
+def bench(index, exact, queries, k):
+    recalls, latencies = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        got = index.search(q, k)
+        latencies.append(time.perf_counter() - t0)
+        truth = exact.search(q, k)
+        recalls.append(len(set(got.tolist()) & set(truth.tolist())) / max(1, len(truth)))
+    lat = np.array(latencies) * 1000
+    print(f"[INFO] {index.name:<10} recall@{k}={np.mean(recalls):.3f} "
+          f"p50={np.percentile(lat, 50):.2f}ms p95={np.percentile(lat, 95):.2f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare vector index backends with brute-force search.")
+    parser.add_argument("--k", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--pgvector", action="store_true", help="Also benchmark the pgvector backend")
+    args = parser.parse_args()
+
+    catalog = refresh_catalog(force=True)
+    rows = np.flatnonzero(catalog.has_embedding)
+    print(f"[INFO] {len(rows)} / {len(catalog)} entries have embeddings")
+    if not len(rows):
+        sys.exit("No embeddings to search.")
+
+    # Perturbed catalog vectors stand in for query embeddings
+    rng = np.random.default_rng(0)
+    picks = rng.choice(rows, min(args.queries, len(rows)), replace=False)
+    queries = catalog.embeddings[picks] + rng.normal(0, 0.02, (len(picks), catalog.embeddings.shape[1])).astype(np.float32)
+
+    exact = BruteForceIndex(catalog)
+    bench(exact, exact, queries, args.k)
+
+    t0 = time.perf_counter()
+    ivf = IVFIndex(catalog, nlist=args.nlist)
+    print(f"[INFO] IVF index with {ivf.nlist} lists ready in {time.perf_counter() - t0:.2f}s")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        print(f"[INFO] nprobe={nprobe}")
+        bench(ivf, exact, queries, args.k)
+
+    if args.pgvector:
+        bench(PgVectorIndex(catalog), exact, queries, args.k)
@@ -20,6 +20,7 @@ export const api = {
     tags: (nsfwOk) => getJSON(`${BASE_URL}/api/tags?nsfw_ok=${nsfwOk ? "true" : "false"}`),
     config: (nsfwOk) => getJSON(`${BASE_URL}/api/config?nsfw_ok=${nsfwOk ? "true" : "false"}`),
     animeById: (id) => getJSON(`${BASE_URL}/api/anime/${id}`),
+    animeByIds: (ids) => getJSON(`${BASE_URL}/api/anime?ids=${ids.join(",")}`),
     recommend: (payload) => postJSON(`${BASE_URL}/api/recommend`, payload),
     recommendMore: (payload) => postJSON(`${BASE_URL}/api/recommend/more`, payload),
 };
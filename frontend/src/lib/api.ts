@@ -28,6 +28,7 @@ export const api = {
     `${BASE_URL}/api/config?nsfw_ok=${nsfwOk ? "true" : "false"}`
   ),
   animeById: (id: number) => getJSON<any>(`${BASE_URL}/api/anime/${id}`),
+  animeByIds: (ids: number[]) => getJSON<any[]>(`${BASE_URL}/api/anime?ids=${ids.join(",")}`),
   recommend: (payload: {
     query?: string;
     liked_ids: number[];